@@ -1,13 +1,29 @@
 import chainlit as cl
-import gspread
-import cohere
 import os
 import json
+import asyncio
 import re
-from google.oauth2.service_account import Credentials
+import csv
+import time
+import bisect
+import threading
+import hashlib
+import sqlite3
+import math
+import functools
+import itertools
+import contextvars
+import cProfile
+import pstats
+import io
+import pickle
+import shutil
 from dotenv import load_dotenv
-from datetime import datetime
-from collections import defaultdict, Counter
+from datetime import datetime, date
+from collections import defaultdict, Counter, OrderedDict, deque
+import contextlib
+from array import array
+import numpy as np
 
 # Load environment variables from .env file (useful for local testing)
 load_dotenv()
@@ -16,48 +32,177 @@ load_dotenv()
 COHERE_API_KEY = os.getenv("API_KEY")  
 GOOGLE_CREDENTIALS = os.getenv("GOOGLE_CREDENTIALS")  # Must be a single-line JSON string
 SPREADSHEET_NAME = "Untitled spreadsheet"  # Replace with your actual Google Sheet name
-
-# Ensure required environment variables are set
-if not COHERE_API_KEY:
-    raise ValueError("ERROR: COHERE_API_KEY environment variable is not set.")
-if not GOOGLE_CREDENTIALS:
-    raise ValueError("ERROR: GOOGLE_CREDENTIALS environment variable is not set.")
-
-# Initialize Cohere API client
-co = cohere.Client(COHERE_API_KEY)
+DATA_SOURCE = os.getenv("DATA_SOURCE", "gsheet")  # "gsheet", or a path to a local .csv/.xlsx export of the sheet
+SHEET_REFRESH_INTERVAL = float(os.getenv("SHEET_REFRESH_INTERVAL", "300"))  # Seconds before cached sheet data is refreshed
+SHEET_SYNC_MODE = os.getenv("SHEET_SYNC_MODE", "full")  # "full" reloads every row, "incremental" only fetches new/changed rows
+SHEET_SYNC_OVERLAP = int(os.getenv("SHEET_SYNC_OVERLAP", "50"))  # Trailing rows re-checked for edits on each incremental sync
+SHEET_FULL_SYNC_EVERY = int(os.getenv("SHEET_FULL_SYNC_EVERY", "12"))  # Every Nth incremental sync re-checks all rows, so edits to older rows are picked up
+COHERE_EMBED_MODEL = os.getenv("COHERE_EMBED_MODEL", "embed-english-v3.0")
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", ".embedding_cache.sqlite3")  # On-disk cache of text embeddings
+SEMANTIC_ROUTER_THRESHOLD = float(os.getenv("SEMANTIC_ROUTER_THRESHOLD", "0.5"))  # Minimum cosine similarity to accept a routed intent
+REPAIR_INDEX_DIR = os.getenv("REPAIR_INDEX_DIR", ".repair_index")  # Where the repair-history vector index is stored
+REPAIR_INDEX_MAX_DEAD_FRACTION = float(os.getenv("REPAIR_INDEX_MAX_DEAD_FRACTION", "0.5"))  # Compact the vector file once this share of it is no longer in the sheet
+RESULTS_PAGE_SIZE = int(os.getenv("RESULTS_PAGE_SIZE", "50"))  # Entries shown per page for long listings
+METRICS_LOG_PATH = os.getenv("METRICS_LOG_PATH")  # Optional JSON-lines file with the timing spans of every message
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")  # Where cProfile dumps of profiled sessions are written
+SLOW_QUERY_SECONDS = float(os.getenv("SLOW_QUERY_SECONDS", "1.0"))  # Profiled messages slower than this are saved
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "512"))  # Answers kept in the response cache (0 disables it)
+SNAPSHOT_PATH = os.getenv("SNAPSHOT_PATH", ".sheet_snapshot.pickle")  # Local snapshot of the parsed sheet for fast restarts ("" disables it)
+SHARED_SNAPSHOT_DIR = os.getenv("SHARED_SNAPSHOT_DIR")  # When set, load the snapshots sheet_loader.py publishes there instead of fetching the sheet
+SHARED_SNAPSHOT_POLL = float(os.getenv("SHARED_SNAPSHOT_POLL", "2"))  # Seconds between checks for a newly published snapshot
 
 # Google Sheets API Scope
 SCOPE = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
 
+# Clients are created on first use (not at import) and shared across all sessions,
+# so the app boots without network calls and can run offline against a local data source.
+_clients_lock = threading.Lock()
+_cohere_client = None
+_sheet = None
+
+# Initialize Cohere API client
+def get_cohere_client():
+    global _cohere_client
+    with _clients_lock:
+        if _cohere_client is None:
+            if not COHERE_API_KEY:
+                raise ValueError("ERROR: COHERE_API_KEY environment variable is not set.")
+            import cohere
+            _cohere_client = cohere.Client(COHERE_API_KEY)
+    return _cohere_client
+
 # Load Google credentials safely
-try:
-    google_credentials = json.loads(GOOGLE_CREDENTIALS)
+def load_google_credentials():
+    if not GOOGLE_CREDENTIALS:
+        raise ValueError("ERROR: GOOGLE_CREDENTIALS environment variable is not set.")
+    try:
+        google_credentials = json.loads(GOOGLE_CREDENTIALS)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"ERROR: Failed to parse GOOGLE_CREDENTIALS JSON: {e}")
     if "private_key" not in google_credentials or not google_credentials["private_key"]:
         raise ValueError("ERROR: Invalid GOOGLE_CREDENTIALS JSON (Missing private_key).")
-except json.JSONDecodeError as e:
-    raise ValueError(f"ERROR: Failed to parse GOOGLE_CREDENTIALS JSON: {e}")
-
-# Authenticate with Google Sheets
-creds = Credentials.from_service_account_info(google_credentials, scopes=SCOPE)
-client = gspread.authorize(creds)
-sheet = client.open(SPREADSHEET_NAME).sheet1
+    return google_credentials
+
+# Authenticate with Google Sheets and open the worksheet
+def open_google_sheet():
+    import gspread
+    from google.oauth2.service_account import Credentials
+    creds = Credentials.from_service_account_info(load_google_credentials(), scopes=SCOPE)
+    client = gspread.authorize(creds)
+    return client.open(SPREADSHEET_NAME).sheet1
+
+# Worksheet over in-memory values, implementing the part of gspread's Worksheet API this app uses.
+# Used as a fixture for offline runs and load tests, and as the base for local file sources.
+class MemoryWorksheet:
+    def __init__(self, header=None, values=None):
+        self.header = list(header or [])
+        self.values = [list(row) for row in values or []]
+
+    @classmethod
+    def from_records(cls, records):
+        header = list(records[0].keys()) if records else []
+        return cls(header, [[row.get(column, "") for column in header] for row in records])
+
+    def get_all_records(self):
+        return records_from_values(self.header, self.values)
+
+    def row_values(self, row):
+        if row == 1:
+            return list(self.header)
+        return list(self.values[row - 2]) if 0 <= row - 2 < len(self.values) else []
+
+    # Supports A1 ranges such as "A2:J", "A2:J100" and "A2"
+    def get_values(self, range_name):
+        match = re.fullmatch(r"[A-Za-z]+(\d+)(?::[A-Za-z]+(\d*))?", range_name)
+        if not match:
+            raise ValueError(f"Unsupported range: {range_name}")
+        first = int(match.group(1))
+        if match.group(2):
+            last = int(match.group(2))
+        elif match.group(2) is None:
+            last = first
+        else:
+            last = len(self.values) + 1
+        rows = ([self.header] if first == 1 else []) + self.values[max(first, 2) - 2:max(last - 1, 0)]
+        return [[str(value) for value in row] for row in rows]
+
+# Function to turn an .xlsx cell into the value the Google Sheet shows: openpyxl returns date cells as
+# datetimes, which are written the way the sheet displays dates so parse_repair_date understands them
+def xlsx_cell(value):
+    if value is None:
+        return ""
+    if isinstance(value, date):
+        return f"{value.month}/{value.day}/{value.year}"
+    return value
+
+# Worksheet backed by a local .csv or .xlsx export of the sheet, re-read when the file changes
+class LocalFileWorksheet(MemoryWorksheet):
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self._mtime = None
+
+    def _reload(self):
+        mtime = os.path.getmtime(self.path)
+        if mtime == self._mtime:
+            return
+        if self.path.lower().endswith(".xlsx"):
+            try:
+                import openpyxl
+            except ImportError:
+                raise ValueError("ERROR: Reading .xlsx data sources requires the openpyxl package.")
+            workbook = openpyxl.load_workbook(self.path, read_only=True, data_only=True)
+            rows = [[xlsx_cell(value) for value in row] for row in workbook.active.iter_rows(values_only=True)]
+            workbook.close()
+        else:
+            with open(self.path, newline="", encoding="utf-8-sig") as f:
+                rows = list(csv.reader(f))
+        self.header = [str(column) for column in rows[0]] if rows else []
+        self.values = rows[1:]
+        self._mtime = mtime
+
+    def get_all_records(self):
+        self._reload()
+        return super().get_all_records()
+
+    def row_values(self, row):
+        self._reload()
+        return super().row_values(row)
+
+    def get_values(self, range_name):
+        self._reload()
+        return super().get_values(range_name)
+
+# Returns the worksheet for the configured DATA_SOURCE, opening it on first use
+def get_sheet():
+    global _sheet
+    with _clients_lock:
+        if _sheet is None:
+            if DATA_SOURCE == "gsheet":
+                _sheet = open_google_sheet()
+            else:
+                _sheet = LocalFileWorksheet(DATA_SOURCE)
+    return _sheet
+
+# Plug in a different data source, e.g. set_data_source(MemoryWorksheet.from_records(rows)).
+# Any object with gspread's get_all_records() (and row_values()/get_values() for incremental sync) works.
+# The local snapshot belongs to the configured sheet, so it is only used again if `snapshot_path` is passed.
+def set_data_source(worksheet, snapshot_path=None):
+    global _sheet, record_store, _snapshot_path
+    with _clients_lock:
+        _sheet = worksheet
+    with _load_lock:
+        record_store = None
+        _snapshot_path = snapshot_path
 
 @cl.on_message
 async def main(message: cl.Message):
     await cl.Message(content="Hello! How can I help you?").send()
 
-cached_data = None
-
-# For fetching data from the google sheet 
+# For fetching data from the google sheet (served from the cached snapshot, see get_record_store)
 def get_machine_issues():
-    global cached_data
-    if cached_data is None:
-        cached_data = sheet.get_all_records()
-        if cached_data:
-            print(f"✅ Column Names in Sheet: {cached_data[0].keys()}")
-        else:
-            print("⚠️ No data found in the sheet!")
-    return cached_data
+    store = get_record_store()
+    return store.rows if store else []
 
 
 def preprocess_text(text):
@@ -68,228 +213,2281 @@ def preprocess_text(text):
 
 # Function to extract Machine ID from user query
 def extract_machine_id(query):
-    machine_id = re.search(r'(mm\d{3})', query, re.IGNORECASE)
-    if machine_id:
-        return machine_id.group(0).upper() 
-    return None
+    return parse_query(query)["machine_id"]
 
 # Function to extract Machine Name from user query
 def extract_machine_name(query):
-    machine_names = ["cnc machine", "lathe machine", "milling machine", "grinding machine", "drilling machine"]
-    for name in machine_names:
-        if name in query.lower():
-            return name
-    return None
+    return parse_query(query)["machine_name"]
 
 # Function to extract Technician Name from user query
 def extract_technician_name(query):
-    technician_names = ["rajesh", "suresh", "vikram", "gopal", "sanjay", "manoj", "anil"]
-    for name in technician_names:
-        if name in query.lower():
-            return name
-    return None
+    return parse_query(query)["technician_name"]
 
 # Function to extract Issue from user query
 def extract_issue(query):
-    issues = ["bearing failure", "spindle overheating", "unexpected shutdown", "excessive vibration", "chatter marks"]
-    for issue in issues:
-        if issue in query.lower():
-            return issue
+    return parse_query(query)["issue"]
+
+# Normalize a key value once so index lookups don't re-case on every query
+def normalize_key(value, upper=False):
+    value = str(value if value is not None else "").strip()
+    return value.upper() if upper else value.lower()
+
+# Parse a numeric sheet cell such as "12.5%" or 3 once at load time.
+# Returns (value, valid); blank cells count as 0 and unparseable ones are flagged invalid.
+def parse_numeric_cell(value):
+    text = str(value if value is not None else "").replace("%", "").strip()
+    if not text:
+        return 0.0, True
+    try:
+        return float(text), True
+    except ValueError:
+        return 0.0, False
+
+# Parse a "Date of Repair" cell into a date ordinal, or None if it isn't a valid date.
+# Cached because the same few hundred dates repeat across the whole sheet.
+@functools.lru_cache(maxsize=4096)
+def parse_repair_date(value):
+    for date_format in ("%m/%d/%Y", "%Y-%m-%d"):
+        try:
+            return datetime.strptime(value, date_format).toordinal()
+        except ValueError:
+            pass
     return None
 
+# Materialized aggregates for one slice of the records (a machine, machine type, issue, technician or everything).
+# Updated incrementally as rows are added or replaced; distinct values are kept in Counters so a
+# value disappears once the last row that had it is removed.
+class AggregateView:
+    def __init__(self, with_issues=True):
+        self.count = 0
+        self.production_loss = 0.0
+        self.repair_time = 0.0
+        # Numeric cells in this slice that failed to parse and were left out of the totals
+        self.excluded_cells = 0
+        self.machines = Counter()
+        self.root_causes = Counter()
+        self.solutions = Counter()
+        # Issue Description (as written in the sheet) -> AggregateView of the rows in this slice with that issue
+        self.issues = {} if with_issues else None
+
+    def add(self, row, production_loss, repair_time, excluded_cells=0, sign=1):
+        self.count += sign
+        self.production_loss += sign * production_loss
+        self.repair_time += sign * repair_time
+        self.excluded_cells += sign * excluded_cells
+        for counter, column in ((self.machines, "Machine Name"), (self.root_causes, "Root Cause"), (self.solutions, "Solution Applied")):
+            value = row.get(column, "N/A")
+            counter[value] += sign
+            # Drop the value once the last row that had it is removed
+            if sign < 0 and counter[value] <= 0:
+                del counter[value]
+        if self.issues is not None:
+            issue = row.get("Issue Description", "N/A")
+            issue_view = self.issues.get(issue)
+            if issue_view is None:
+                issue_view = self.issues[issue] = AggregateView(with_issues=False)
+            issue_view.add(row, production_loss, repair_time, excluded_cells, sign)
+            if not issue_view.count:
+                del self.issues[issue]
+
+    def remove(self, row, production_loss, repair_time, excluded_cells=0):
+        self.add(row, production_loss, repair_time, excluded_cells, sign=-1)
+
+    # Issues in this slice ordered by occurrence count: [(issue, AggregateView)]
+    def top_issues(self, top_n=None):
+        ranked = sorted(self.issues.items(), key=lambda item: item[1].count, reverse=True)
+        return ranked[:top_n] if top_n else ranked
+
+    def copy(self):
+        view = AggregateView(with_issues=self.issues is not None)
+        view.count = self.count
+        view.production_loss = self.production_loss
+        view.repair_time = self.repair_time
+        view.excluded_cells = self.excluded_cells
+        view.machines = Counter(self.machines)
+        view.root_causes = Counter(self.root_causes)
+        view.solutions = Counter(self.solutions)
+        if self.issues is not None:
+            view.issues = {issue: issue_view.copy() for issue, issue_view in self.issues.items()}
+        return view
+
+# Read-only rows of a published snapshot (see RecordStore.export_columns). Each row is stored as a
+# pickled tuple in a memory-mapped byte array and decoded into a dict when it is read.
+class MappedRows:
+    def __init__(self, header, offsets, data):
+        self.header = header
+        self.offsets = offsets
+        self.data = data
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [self[index] for index in range(*position.indices(len(self)))]
+        if position < 0:
+            position += len(self)
+        if not 0 <= position < len(self):
+            raise IndexError("row position out of range")
+        return dict(zip(self.header, pickle.loads(self.data[self.offsets[position]:self.offsets[position + 1]])))
+
+    def __iter__(self):
+        for position in range(len(self)):
+            yield self[position]
+
+# Read-only machine timeline of a published snapshot over two memory-mapped columns. Items are
+# (date ordinal, position) tuples like in the list it replaces, so bisect works on it unchanged.
+class MappedTimeline:
+    def __init__(self, ordinals, positions):
+        self.ordinals = ordinals
+        self.positions = positions
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return list(zip(self.ordinals[index], self.positions[index]))
+        return (self.ordinals[index], self.positions[index])
+
+_store_versions = itertools.count(1)
+
+# In-memory record store with hash indexes over the sheet rows (built once per load)
+class RecordStore:
+    def __init__(self, rows=None):
+        # When this snapshot was built, used to decide when it has gone stale
+        self.loaded_at = time.monotonic()
+        # Data-version stamp: every snapshot (including incremental copies) gets a new one
+        self.version = next(_store_versions)
+        self.rows = []
+        self.by_id = defaultdict(list)
+        self.by_machine_name = defaultdict(list)
+        self.by_technician = defaultdict(list)
+        self.by_issue = defaultdict(list)
+        # Numeric columns parsed once into typed arrays, with a validity mask per column
+        self.production_loss = array("d")
+        self.production_loss_valid = bytearray()
+        self.repair_time = array("d")
+        self.repair_time_valid = bytearray()
+        # Repair dates parsed once as date ordinals (0 when missing or invalid)
+        self.repair_dates = array("l")
+        # Per-machine timeline: machine ID -> sorted [(date ordinal, position)], rows with bad dates left out
+        self.timelines = defaultdict(list)
+        # Materialized aggregates: one global view plus one per key of each index
+        self.global_view = AggregateView()
+        self.views = {index_name: {} for index_name, _, _ in self.INDEXED_COLUMNS}
+        # (position, column, raw value) for every cell that failed to parse
+        self.invalid_cells = []
+        # Sheet header row, used by incremental sync to detect layout changes
+        self.header = list(rows[0].keys()) if rows else []
+        if rows:
+            self.add_rows(rows)
+
+    # Columns indexed for lookups, with the normalization applied to their keys
+    INDEXED_COLUMNS = (
+        ("by_id", "ID", True),
+        ("by_machine_name", "Machine Name", False),
+        ("by_technician", "Technician Name", False),
+        ("by_issue", "Issue Description", False),
+    )
+
+    def add_rows(self, rows):
+        invalid_before = len(self.invalid_cells)
+        for row in rows:
+            position = len(self.rows)
+            self.rows.append(row)
+            self.production_loss.append(0.0)
+            self.production_loss_valid.append(True)
+            self.repair_time.append(0.0)
+            self.repair_time_valid.append(True)
+            self.repair_dates.append(0)
+            self._index_row(position, row)
+        self._report_invalid(invalid_before)
+
+    # Replace rows in place, e.g. when a synced sheet row was edited: {position: row}
+    def replace_rows(self, changed_rows):
+        changed_positions = set(changed_rows)
+        self.invalid_cells = [cell for cell in self.invalid_cells if cell[0] not in changed_positions]
+        invalid_before = len(self.invalid_cells)
+        for position, row in changed_rows.items():
+            self._unindex_row(position, self.rows[position])
+            self.rows[position] = row
+            self._index_row(position, row)
+        self._report_invalid(invalid_before)
+
+    def _index_row(self, position, row):
+        self._set_numeric(position, row, "Production Loss (%)", self.production_loss, self.production_loss_valid)
+        self._set_numeric(position, row, "Time Taken (in hours)", self.repair_time, self.repair_time_valid)
+        self._set_repair_date(position, row)
+        production_loss = self.production_loss[position]
+        repair_time = self.repair_time[position]
+        excluded_cells = self._excluded_cells(position)
+        self.global_view.add(row, production_loss, repair_time, excluded_cells)
+        for index_name, column, upper in self.INDEXED_COLUMNS:
+            key = normalize_key(row.get(column), upper=upper)
+            views = self.views[index_name]
+            view = views.get(key)
+            if view is None:
+                # Per-issue breakdowns of the issue views would just repeat the view itself
+                view = views[key] = AggregateView(with_issues=index_name != "by_issue")
+            view.add(row, production_loss, repair_time, excluded_cells)
+            positions = getattr(self, index_name)[key]
+            # Appends keep positions in sheet order; replaced rows are inserted back in order
+            if positions and positions[-1] > position:
+                bisect.insort(positions, position)
+            else:
+                positions.append(position)
+
+    def _unindex_row(self, position, row):
+        ordinal = self.repair_dates[position]
+        if ordinal:
+            machine_id = normalize_key(row.get("ID"), upper=True)
+            timeline = self.timelines[machine_id]
+            timeline.remove((ordinal, position))
+            if not timeline:
+                del self.timelines[machine_id]
+        # Numeric columns and their masks still hold this row's values until _index_row overwrites them
+        production_loss = self.production_loss[position]
+        repair_time = self.repair_time[position]
+        excluded_cells = self._excluded_cells(position)
+        self.global_view.remove(row, production_loss, repair_time, excluded_cells)
+        for index_name, column, upper in self.INDEXED_COLUMNS:
+            index = getattr(self, index_name)
+            key = normalize_key(row.get(column), upper=upper)
+            views = self.views[index_name]
+            views[key].remove(row, production_loss, repair_time, excluded_cells)
+            if not views[key].count:
+                del views[key]
+            positions = index[key]
+            positions.remove(position)
+            if not positions:
+                del index[key]
+
+    def _set_numeric(self, position, row, column, values, valid):
+        value, ok = parse_numeric_cell(row.get(column, "0"))
+        values[position] = value
+        valid[position] = ok
+        if not ok:
+            self.invalid_cells.append((position, column, row.get(column)))
+
+    # Number of this row's numeric cells that failed to parse (they count as 0 in the totals)
+    def _excluded_cells(self, position):
+        return (not self.production_loss_valid[position]) + (not self.repair_time_valid[position])
+
+    # Bad or blank dates are quarantined here once, instead of failing at query time
+    def _set_repair_date(self, position, row):
+        raw = str(row.get("Date of Repair", "")).strip()
+        ordinal = parse_repair_date(raw) if raw else None
+        self.repair_dates[position] = ordinal or 0
+        if ordinal:
+            bisect.insort(self.timelines[normalize_key(row.get("ID"), upper=True)], (ordinal, position))
+        elif raw:
+            self.invalid_cells.append((position, "Date of Repair", raw))
+
+    def _report_invalid(self, start):
+        # Report parse failures once per load instead of on every query
+        for position, column, raw in self.invalid_cells[start:]:
+            print(f"Warning: Could not parse '{raw}' in '{column}' (row {position + 2}). Ignoring it.")
+
+    # Copy of the store that deltas can be applied to without touching the snapshot readers are using.
+    # Rows are shared (they are never mutated), only the containers are copied.
+    def copy(self):
+        store = RecordStore()
+        store.header = list(self.header)
+        store.rows = list(self.rows)
+        for index_name, _, _ in self.INDEXED_COLUMNS:
+            index = getattr(store, index_name)
+            for key, positions in getattr(self, index_name).items():
+                index[key] = list(positions)
+        store.production_loss = array("d", self.production_loss)
+        store.production_loss_valid = bytearray(self.production_loss_valid)
+        store.repair_time = array("d", self.repair_time)
+        store.repair_time_valid = bytearray(self.repair_time_valid)
+        store.repair_dates = array("l", self.repair_dates)
+        for machine_id, timeline in self.timelines.items():
+            store.timelines[machine_id] = list(timeline)
+        store.global_view = self.global_view.copy()
+        store.views = {
+            index_name: {key: view.copy() for key, view in views.items()}
+            for index_name, views in self.views.items()
+        }
+        store.invalid_cells = list(self.invalid_cells)
+        return store
+
+    # Compact pickled form for the local snapshot: rows become value tuples in header order,
+    # with equal strings shared so pickle writes each distinct value only once
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if all(list(row) == self.header for row in self.rows):
+            strings = {}
+            state["rows"] = [
+                tuple(strings.setdefault(value, value) if isinstance(value, str) else value for value in row.values())
+                for row in self.rows
+            ]
+        return state
+
+    def __setstate__(self, state):
+        rows = state["rows"]
+        if rows and isinstance(rows[0], tuple):
+            state["rows"] = [dict(zip(state["header"], values)) for values in rows]
+        self.__dict__.update(state)
+        # Versions and load times are per process
+        self.version = next(_store_versions)
+        self.loaded_at = time.monotonic()
+
+    # Split the store for shared mode: the bulky parts (rows, numeric and date columns, and the
+    # positions of the indexes and timelines) become flat arrays that every worker memory-maps
+    # read-only, so adding workers doesn't add copies of them. Returns (state, arrays); the state
+    # is the small remainder that gets pickled, with the offsets of each key's positions.
+    def export_columns(self):
+        arrays = {
+            "production_loss": np.asarray(self.production_loss, dtype=np.float64),
+            "production_loss_valid": np.frombuffer(bytes(self.production_loss_valid), dtype=np.uint8),
+            "repair_time": np.asarray(self.repair_time, dtype=np.float64),
+            "repair_time_valid": np.frombuffer(bytes(self.repair_time_valid), dtype=np.uint8),
+            "repair_dates": np.asarray(self.repair_dates, dtype=np.int64),
+        }
+        columns = list(arrays)
+        state = {name: value for name, value in self.__dict__.items() if name not in columns}
+        if all(list(row) == self.header for row in self.rows):
+            encoded = [pickle.dumps(tuple(row.values()), protocol=pickle.HIGHEST_PROTOCOL) for row in self.rows]
+            arrays["row_offsets"] = np.cumsum([0] + [len(row) for row in encoded], dtype=np.int64)
+            arrays["row_data"] = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+            del state["rows"]
+        # key -> (start, stop) into the concatenated positions of each index and of the timelines
+        layout = {}
+        for index_name, _, _ in self.INDEXED_COLUMNS:
+            index = getattr(self, index_name)
+            layout[index_name] = self._offsets(index)
+            arrays[index_name] = np.fromiter(itertools.chain.from_iterable(index.values()), dtype=np.int64)
+            del state[index_name]
+        layout["timelines"] = self._offsets(self.timelines)
+        timeline = list(itertools.chain.from_iterable(self.timelines.values()))
+        arrays["timeline_dates"] = np.fromiter((ordinal for ordinal, _ in timeline), dtype=np.int64, count=len(timeline))
+        arrays["timeline_positions"] = np.fromiter((position for _, position in timeline), dtype=np.int64, count=len(timeline))
+        del state["timelines"]
+        state["column_layout"] = layout
+        return state, arrays
+
+    @staticmethod
+    def _offsets(lists):
+        offsets = {}
+        start = 0
+        for key, values in lists.items():
+            offsets[key] = (start, start + len(values))
+            start += len(values)
+        return offsets
+
+    # Rebuild a read-only store from export_columns() output, with `arrays` memory-mapped.
+    # Use copy() to get a store that deltas can be applied to.
+    @classmethod
+    def from_columns(cls, state, arrays):
+        store = cls.__new__(cls)
+        state = dict(state)
+        layout = state.pop("column_layout")
+        store.__dict__.update(state)
+        # memoryviews index to plain Python floats and ints, like the arrays they stand in for
+        columns = {name: memoryview(values) for name, values in arrays.items()}
+        for name in ("production_loss", "production_loss_valid", "repair_time", "repair_time_valid", "repair_dates"):
+            setattr(store, name, columns[name])
+        if "row_data" in columns:
+            store.rows = MappedRows(store.header, columns["row_offsets"], columns["row_data"])
+        for index_name, _, _ in cls.INDEXED_COLUMNS:
+            positions = columns[index_name]
+            setattr(store, index_name, {key: positions[start:stop] for key, (start, stop) in layout[index_name].items()})
+        dates, positions = columns["timeline_dates"], columns["timeline_positions"]
+        store.timelines = {key: MappedTimeline(dates[start:stop], positions[start:stop]) for key, (start, stop) in layout["timelines"].items()}
+        store.version = next(_store_versions)
+        store.loaded_at = time.monotonic()
+        return store
+
+    # Index lookups return row positions; .get() so that a miss doesn't insert into the defaultdict
+    def positions_by_id(self, machine_id):
+        return self.by_id.get(normalize_key(machine_id, upper=True), [])
+
+    def positions_by_technician(self, technician_name):
+        return self.by_technician.get(normalize_key(technician_name), [])
+
+    def rows_at(self, positions):
+        return [self.rows[position] for position in positions]
+
+    def find_by_id(self, machine_id):
+        return self.rows_at(self.positions_by_id(machine_id))
+
+    def find_by_technician(self, technician_name):
+        return self.rows_at(self.positions_by_technician(technician_name))
+
+    # Position of the most recent repair of a machine (the first one listed if several share that date).
+    # Falls back to the last row in sheet order when none of the machine's dates are valid.
+    def latest_position(self, machine_id):
+        machine_id = normalize_key(machine_id, upper=True)
+        timeline = self.timelines.get(machine_id)
+        if timeline:
+            return timeline[bisect.bisect_left(timeline, (timeline[-1][0], -1))][1]
+        positions = self.by_id.get(machine_id)
+        return positions[-1] if positions else None
+
+    # Positions of a machine's repairs ordered by date, optionally limited to [start, end] (date ordinals)
+    def timeline_positions(self, machine_id, start=None, end=None):
+        timeline = self.timelines.get(normalize_key(machine_id, upper=True), [])
+        first = bisect.bisect_left(timeline, (start, -1)) if start is not None else 0
+        last = bisect.bisect_right(timeline, (end, float("inf"))) if end is not None else len(timeline)
+        return [position for _, position in timeline[first:last]]
+
+    # Materialized view for a slice, e.g. view("by_machine_name", "cnc machine"); the global view when index_name is None
+    def view(self, index_name=None, key=None):
+        if index_name is None:
+            return self.global_view
+        upper = index_name == "by_id"
+        return self.views[index_name].get(normalize_key(key, upper=upper))
+
+# Current snapshot of the sheet. It is only ever replaced as a whole (a single
+# reference assignment), so readers always see a consistent set of rows and indexes.
+record_store = None
+# Guards the actual sheet fetch so that only one load runs at a time
+_load_lock = threading.RLock()
+_refresh_state_lock = threading.Lock()
+_refresh_thread = None
+_last_refresh_started = 0.0
+
+# Build the next record store: from the loader's published snapshots in shared mode, otherwise from the sheet
+def load_record_store():
+    if SHARED_SNAPSHOT_DIR:
+        return load_published_record_store()
+    return fetch_record_store(record_store)
+
+# Fetch rows from the sheet and build a new record store (blocking network call).
+# `store` is the previous snapshot that incremental sync starts from.
+def fetch_record_store(store=None):
+    if SHEET_SYNC_MODE == "incremental":
+        return sync_record_store(get_sheet(), store)
+    data = get_sheet().get_all_records()
+    if data:
+        print(f"✅ Column Names in Sheet: {data[0].keys()}")
+    else:
+        print("⚠️ No data found in the sheet!")
+    return RecordStore(data)
+
+# Convert raw sheet values into records the same way get_all_records() does
+def records_from_values(header, values):
+    from gspread.utils import numericise_all
+    records = []
+    for row_values in values:
+        row_values = list(row_values) + [""] * (len(header) - len(row_values))
+        records.append(dict(zip(header, numericise_all(row_values[:len(header)]))))
+    return records
+
+# Workers in shared mode get their data from the loader's snapshots, so they don't keep their own
+_snapshot_path = "" if SHARED_SNAPSHOT_DIR else SNAPSHOT_PATH
+_snapshot_lock = threading.Lock()
+_saved_snapshot_version = 0
+SNAPSHOT_FORMAT = 2  # Bumped whenever the pickled RecordStore layout changes
+
+# Identifies the sheet a snapshot was taken from, so a snapshot of another sheet is never served
+def snapshot_source():
+    return SPREADSHEET_NAME if DATA_SOURCE == "gsheet" else os.path.abspath(DATA_SOURCE)
+
+# Write a record store to the local snapshot file (atomically, so a crash never leaves a torn file)
+def save_snapshot(store, path=None):
+    global _saved_snapshot_version
+    path = path or _snapshot_path
+    if not path:
+        return
+    with _snapshot_lock:
+        # A newer snapshot may already have been written by another refresh
+        if store.version <= _saved_snapshot_version:
+            return
+        try:
+            write_snapshot_file(path, store=store)
+            _saved_snapshot_version = store.version
+        except Exception as e:
+            print(f"⚠️ Could not save the local snapshot: {e}")
+
+# Pickle a snapshot (a record store, or the state of one published with its columns) to `path`
+# through a temporary file, so readers never see a partial file
+def write_snapshot_file(path, **contents):
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, "wb") as f:
+        pickle.dump({"format": SNAPSHOT_FORMAT, "source": snapshot_source(), "saved_at": time.time(), **contents}, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temporary_path, path)
+
+# Save the snapshot on a worker thread so refreshes (and first answers) don't wait on the disk
+def save_snapshot_in_background(store):
+    if _snapshot_path:
+        threading.Thread(target=save_snapshot, args=(store,), name="snapshot-save", daemon=True).start()
+
+# Read the local snapshot written by save_snapshot(); None when it is missing, unreadable or from another sheet.
+# The file is only ever written by this app, so unpickling it is trusted. Workers in shared mode pass
+# check_source=False: whatever the loader publishes is their data, whichever DATA_SOURCE it was run with.
+def load_snapshot(path=None, check_source=True):
+    path = path or _snapshot_path
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        with open(path, "rb") as f:
+            snapshot = pickle.load(f)
+    except Exception as e:
+        print(f"⚠️ Could not read the local snapshot {path}: {e}")
+        return None
+    if snapshot.get("format") != SNAPSHOT_FORMAT or (check_source and snapshot.get("source") != snapshot_source()):
+        print(f"⚠️ Ignoring the local snapshot {path}: it was saved for another sheet or format.")
+        return None
+    if "columns" in snapshot:
+        # Published snapshot: the columns sit next to it as .npy files that are mapped, not read
+        store = RecordStore.from_columns(snapshot["state"], map_columns(os.path.join(os.path.dirname(path), snapshot["columns"])))
+    else:
+        store = snapshot["store"]
+    saved_at = datetime.fromtimestamp(snapshot["saved_at"]).strftime("%Y-%m-%d %H:%M:%S")
+    print(f"💾 Loaded {len(store.rows)} rows from the snapshot {path} saved at {saved_at}.")
+    return store
+
+# Serve the local snapshot right away and reconcile it with the sheet in the background
+def restore_record_store():
+    global record_store
+    with _load_lock:
+        store = load_snapshot()
+        if store is None:
+            return None
+        prepare_query_matcher(store)
+        record_store = store
+    start_background_refresh()
+    return store
+
+# Shared-cache mode: one sheet_loader.py process fetches the sheet and publishes numbered snapshots
+# (snapshot-<version>.pickle with its columns in snapshot-<version>.columns/) plus a small manifest
+# pointing at the latest one. Workers never call the Google API; they load the latest snapshot and a
+# watcher thread swaps in newer ones. The columns are memory-mapped read-only, so every worker on
+# the machine shares one copy of them through the page cache.
+SHARED_MANIFEST = "current.json"
+SHARED_SNAPSHOTS_KEPT = 3  # Older snapshot files are deleted, keeping a few for workers still reading them
+_published_version = 0  # Version of the published snapshot this process has loaded
+_snapshot_watcher = None
+
+# The manifest of a shared snapshot directory ({"version", "file", "published_at", "rows"}), or None
+def read_manifest(directory):
+    try:
+        with open(os.path.join(directory, SHARED_MANIFEST), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+# Publish a record store as snapshot `version`: its columns and snapshot file first, then the manifest that points at it
+def publish_snapshot(store, directory, version):
+    os.makedirs(directory, exist_ok=True)
+    file_name = f"snapshot-{version:08d}.pickle"
+    columns_name = f"snapshot-{version:08d}.columns"
+    state, arrays = store.export_columns()
+    columns_path = os.path.join(directory, columns_name)
+    os.makedirs(columns_path, exist_ok=True)
+    for name, values in arrays.items():
+        np.save(os.path.join(columns_path, f"{name}.npy"), values)
+    write_snapshot_file(os.path.join(directory, file_name), state=state, columns=columns_name)
+    manifest = {"version": version, "file": file_name, "published_at": time.time(), "rows": len(store.rows)}
+    temporary_path = os.path.join(directory, f"{SHARED_MANIFEST}.tmp")
+    with open(temporary_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(temporary_path, os.path.join(directory, SHARED_MANIFEST))
+    for old_file in sorted(name for name in os.listdir(directory) if re.fullmatch(r"snapshot-\d+\.pickle", name))[:-SHARED_SNAPSHOTS_KEPT]:
+        os.remove(os.path.join(directory, old_file))
+        # Workers still mapping these columns keep their pages until they switch snapshots
+        shutil.rmtree(os.path.join(directory, old_file.replace(".pickle", ".columns")), ignore_errors=True)
+    return manifest
+
+# Memory-map every column file of a published snapshot read-only: {name: array}
+def map_columns(path):
+    return {
+        file_name[:-len(".npy")]: np.load(os.path.join(path, file_name), mmap_mode="r")
+        for file_name in os.listdir(path)
+        if file_name.endswith(".npy")
+    }
+
+# Load the latest published snapshot; keeps the current store when it is already the latest version
+def load_published_record_store():
+    global _published_version
+    manifest = read_manifest(SHARED_SNAPSHOT_DIR)
+    if manifest is None:
+        raise RuntimeError(f"No snapshot has been published to {SHARED_SNAPSHOT_DIR} yet (is sheet_loader.py running?)")
+    if record_store is not None and manifest["version"] == _published_version:
+        record_store.loaded_at = time.monotonic()
+        return record_store
+    store = load_snapshot(os.path.join(SHARED_SNAPSHOT_DIR, manifest["file"]), check_source=False)
+    if store is None:
+        raise RuntimeError(f"Could not load published snapshot {manifest['version']}")
+    _published_version = manifest["version"]
+    return store
+
+# Watch the manifest and swap in each newly published snapshot as soon as it appears
+def _watch_published_snapshots():
+    while True:
+        time.sleep(SHARED_SNAPSHOT_POLL)
+        try:
+            manifest = read_manifest(SHARED_SNAPSHOT_DIR)
+            if manifest and manifest["version"] != _published_version:
+                refresh_record_store()
+                print(f"🔄 Switched to published snapshot {_published_version}.")
+        except Exception as e:
+            print(f"⚠️ Could not load the published snapshot: {e}")
+
+def start_snapshot_watcher():
+    global _snapshot_watcher
+    with _refresh_state_lock:
+        if _snapshot_watcher is None:
+            _snapshot_watcher = threading.Thread(target=_watch_published_snapshots, name="snapshot-watcher", daemon=True)
+            _snapshot_watcher.start()
+
+# Incremental syncs since every row was last compared with the sheet; None until the first full pass
+# of this process, so a store resumed from a snapshot is fully re-checked once
+_syncs_since_full_pass = None
+
+# Make the next incremental sync compare every row (e.g. after a manual invalidation)
+def request_full_sync():
+    global _syncs_since_full_pass
+    _syncs_since_full_pass = None
+
+# Incrementally sync a record store with a worksheet.
+# Only the trailing SHEET_SYNC_OVERLAP rows already seen plus any appended rows are fetched;
+# edited rows in that window are replaced and new rows appended to a copy of the store.
+# Every SHEET_FULL_SYNC_EVERY syncs (and on the first sync of a process) all rows are fetched and
+# compared instead, so edits to older rows are picked up too; only the changed rows are re-indexed.
+# Falls back to a full reload when there is no store yet, the header changed or rows were deleted.
+# `worksheet` only needs gspread's row_values() and get_values(), so a local fake works for testing.
+def sync_record_store(worksheet, store=None):
+    global _syncs_since_full_pass
+    header = worksheet.row_values(1)
+    from gspread.utils import rowcol_to_a1
+    last_column = re.sub(r"\d", "", rowcol_to_a1(1, max(len(header), 1)))
+
+    if store is None or header != store.header:
+        values = worksheet.get_values(f"A2:{last_column}") if header else []
+        store = RecordStore(records_from_values(header, values))
+        store.header = header
+        _syncs_since_full_pass = 0
+        print(f"✅ Loaded {len(store.rows)} rows from the sheet (full sync).")
+        return store
+
+    seen = len(store.rows)
+    full_pass = _syncs_since_full_pass is None or _syncs_since_full_pass + 1 >= SHEET_FULL_SYNC_EVERY
+    _syncs_since_full_pass = 0 if full_pass else _syncs_since_full_pass + 1
+    first_position = 0 if full_pass else max(0, seen - SHEET_SYNC_OVERLAP)
+    # Sheet row numbers are 1-based and row 1 is the header
+    values = worksheet.get_values(f"A{first_position + 2}:{last_column}")
+    fetched = records_from_values(header, values)
+    if first_position + len(fetched) < seen:
+        # Rows were removed from the sheet, positions no longer line up
+        print("⚠️ Sheet has fewer rows than before, doing a full reload.")
+        return sync_record_store(worksheet, None)
+
+    overlap = fetched[:seen - first_position]
+    changed_rows = {
+        first_position + offset: row
+        for offset, row in enumerate(overlap)
+        if row != store.rows[first_position + offset]
+    }
+    new_rows = fetched[seen - first_position:]
+    if not changed_rows and not new_rows:
+        store.loaded_at = time.monotonic()
+        return store
+
+    store = store.copy()
+    if changed_rows:
+        store.replace_rows(changed_rows)
+    if new_rows:
+        store.add_rows(new_rows)
+    print(f"🔄 {'Full-pass' if full_pass else 'Incremental'} sync: {len(new_rows)} new and {len(changed_rows)} changed rows.")
+    return store
+
+# Reload the sheet now and swap the new snapshot in, blocking until it is done
+def refresh_record_store():
+    global record_store
+    with _load_lock:
+        store = load_record_store()
+        # Answers cached from the previous snapshot are stale now
+        if store is not record_store:
+            prepare_query_matcher(store)
+            response_cache.clear()
+            save_snapshot_in_background(store)
+        record_store = store
+    return store
+
+def _background_refresh():
+    try:
+        refresh_record_store()
+        print("🔄 Sheet data refreshed in the background.")
+    except Exception as e:
+        # Keep serving the previous snapshot; the next stale read will retry
+        print(f"⚠️ Background refresh of sheet data failed: {e}")
+
+# Start a refresh on a worker thread unless one is already running
+def start_background_refresh():
+    global _refresh_thread, _last_refresh_started
+    with _refresh_state_lock:
+        if _refresh_thread is not None and _refresh_thread.is_alive():
+            return False
+        _last_refresh_started = time.monotonic()
+        _refresh_thread = threading.Thread(target=_background_refresh, name="sheet-refresh", daemon=True)
+        _refresh_thread.start()
+    return True
+
+# Block until a running background refresh has finished (batch runs want the sheet, not a stale snapshot)
+def wait_for_background_refresh():
+    thread = _refresh_thread
+    if thread is not None:
+        thread.join()
+
+# Manual invalidation hook: refresh the cached sheet data now.
+# By default the current snapshot keeps being served until the refresh completes.
+def invalidate_machine_issues(blocking=False):
+    request_full_sync()
+    if blocking:
+        return refresh_record_store()
+    start_background_refresh()
+    return record_store
+
+# Returns the current record store (stale-while-revalidate).
+# Only the very first load blocks; afterwards a stale snapshot is served while it refreshes in the background.
+def get_record_store():
+    store = record_store
+    if store is None:
+        # Shared mode: newer snapshots are pushed in by the watcher instead of stale reads refreshing
+        if SHARED_SNAPSHOT_DIR:
+            start_snapshot_watcher()
+        with _load_lock:
+            # Another caller may have finished the first load while we waited;
+            # otherwise start from the local snapshot if there is one, else fetch the sheet
+            store = record_store or restore_record_store() or refresh_record_store()
+    elif not SHARED_SNAPSHOT_DIR and time.monotonic() - max(store.loaded_at, _last_refresh_started) > SHEET_REFRESH_INTERVAL:
+        start_background_refresh()
+    if not store.rows:
+        return None
+    return store
+
+_load_task = None
+
+# Async access to the record store for the Chainlit handlers.
+# A cold load runs in a worker thread instead of on the event loop, and concurrent
+# first requests all await the same in-flight task rather than each fetching the sheet.
+async def get_record_store_async():
+    global _load_task
+    if record_store is not None:
+        # Warm cache: never blocks, a stale snapshot only starts a background refresh thread
+        return get_record_store()
+    if _load_task is None:
+        _load_task = asyncio.ensure_future(asyncio.to_thread(get_record_store))
+        _load_task.add_done_callback(_clear_load_task)
+    # shield() so one cancelled session doesn't cancel the load the others are waiting on
+    return await asyncio.shield(_load_task)
+
+def _clear_load_task(task):
+    global _load_task
+    if _load_task is task:
+        _load_task = None
+
+# Latency histogram for one (intent, stage) pair, with Prometheus-style cumulative buckets
+# and a bounded window of recent samples for p50/p95/p99
+class LatencyHistogram:
+    BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, window=2048):
+        self.bucket_counts = [0] * len(self.BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+        self.samples = deque(maxlen=window)
+
+    def observe(self, seconds):
+        self.count += 1
+        self.sum += seconds
+        self.samples.append(seconds)
+        for number, bound in enumerate(self.BUCKETS):
+            if seconds <= bound:
+                self.bucket_counts[number] += 1
+
+    def percentile(self, fraction):
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+# Process-wide latency metrics: (intent, stage) -> LatencyHistogram, plus simple counters
+class LatencyMetrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.counters = Counter()
+
+    def record(self, intent, spans):
+        with self.lock:
+            for stage, seconds in spans.items():
+                histogram = self.histograms.get((intent, stage))
+                if histogram is None:
+                    histogram = self.histograms[(intent, stage)] = LatencyHistogram()
+                histogram.observe(seconds)
+
+    def increment(self, name, labels=(), amount=1):
+        with self.lock:
+            self.counters[(name, tuple(labels))] += amount
+
+    def summary(self):
+        with self.lock:
+            return {
+                f"{intent}/{stage}": {
+                    "count": histogram.count,
+                    "p50": histogram.percentile(0.5),
+                    "p95": histogram.percentile(0.95),
+                    "p99": histogram.percentile(0.99),
+                }
+                for (intent, stage), histogram in sorted(self.histograms.items())
+            }
+
+    # Prometheus text exposition format
+    def render_prometheus(self):
+        lines = [
+            "# HELP chat_stage_seconds Time spent per stage of handling a chat message.",
+            "# TYPE chat_stage_seconds histogram",
+        ]
+        quantile_lines = [
+            "# HELP chat_stage_quantile_seconds Recent p50/p95/p99 latency per stage of handling a chat message.",
+            "# TYPE chat_stage_quantile_seconds summary",
+        ]
+        with self.lock:
+            for (intent, stage), histogram in sorted(self.histograms.items()):
+                labels = f'intent="{intent}",stage="{stage}"'
+                for bound, bucket_count in zip(histogram.BUCKETS, histogram.bucket_counts):
+                    lines.append(f'chat_stage_seconds_bucket{{{labels},le="{bound}"}} {bucket_count}')
+                lines.append(f'chat_stage_seconds_bucket{{{labels},le="+Inf"}} {histogram.count}')
+                lines.append(f"chat_stage_seconds_sum{{{labels}}} {histogram.sum}")
+                lines.append(f"chat_stage_seconds_count{{{labels}}} {histogram.count}")
+                for quantile in (0.5, 0.95, 0.99):
+                    quantile_lines.append(f'chat_stage_quantile_seconds{{{labels},quantile="{quantile}"}} {histogram.percentile(quantile)}')
+                quantile_lines.append(f"chat_stage_quantile_seconds_sum{{{labels}}} {histogram.sum}")
+                quantile_lines.append(f"chat_stage_quantile_seconds_count{{{labels}}} {histogram.count}")
+            counter_names = sorted({name for name, _ in self.counters})
+            for name in counter_names:
+                lines.append(f"# TYPE {name} counter")
+                for (counter_name, labels), value in sorted(self.counters.items()):
+                    if counter_name == name:
+                        label_text = ",".join(f'{key}="{label}"' for key, label in labels)
+                        lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+        return "\n".join(lines + quantile_lines) + "\n"
+
+metrics = LatencyMetrics()
+
+# Timing spans for handling one message
+class QueryTrace:
+    def __init__(self, query):
+        self.query = query
+        self.intent = "unknown"
+        self.spans = defaultdict(float)
+        self.started = time.perf_counter()
+        self.labels = {}
+
+    @contextlib.contextmanager
+    def span(self, stage):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.spans[stage] += time.perf_counter() - started
+
+    # Close the trace: whatever time wasn't covered by a span is routing and response formatting
+    def finish(self):
+        total = time.perf_counter() - self.started
+        self.spans["formatting"] += max(0.0, total - sum(self.spans.values()))
+        self.spans["total"] = total
+        metrics.record(self.intent, self.spans)
+        if METRICS_LOG_PATH:
+            entry = {"ts": time.time(), "intent": self.intent, **self.labels, "spans": dict(self.spans)}
+            with _metrics_log_lock:
+                with open(METRICS_LOG_PATH, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(entry) + "\n")
+        return total
+
+_metrics_log_lock = threading.Lock()
+# Trace of the message being handled; context variables follow the handler into asyncio.to_thread workers
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+
+# Span in the current message's trace (a no-op outside of a traced message)
+@contextlib.contextmanager
+def trace_span(stage):
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    with trace.span(stage):
+        yield
+
+# Decorator recording a query helper's run time as the given stage of the current trace
+def timed(stage):
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with trace_span(stage):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+# Keywords for each intent, in the priority order the message handler checks them.
+# The aggregate intents come first, so "repaired by" in e.g. "most repeated issue repaired by vikram"
+# filters the aggregate instead of asking for the technician's listing.
+# Queries that match none of them are treated as a Machine ID lookup ("machine_info").
+INTENT_KEYWORDS = [
+    ("root_cause", ["root cause", "cause of", "what causes"]),
+    ("production_loss", ["production loss", "hours taken"]),
+    ("count", ["count", "number of", "how many"]),
+    ("most_repeated", ["most repeated", "most occured", "repeated problem"]),
+    ("technician_repairs", ["repaired by", "handled by"]),
+    ("similar_fixes", ["similar", "what fixed", "fixed this before", "fixed before", "past fixes"]),
+    ("next_page", ["show next", "next page", "show more", "more results"]),
+    ("repair_history", ["history", "since", "between", "before", "after", "until"]),
+]
+
+# Keywords that pick a single column for a Machine ID lookup, in priority order
+COLUMN_KEYWORDS = [
+    ("Technician Name", ["technician", "name of technician", "who handled"]),
+    ("Issue Description", ["issue"]),
+    ("Root Cause", ["root cause"]),
+    ("Solution Applied", ["solution"]),
+    ("Date of Repair", ["date"]),
+    ("Time Taken (in hours)", ["time"]),
+    ("Production Loss (%)", ["production loss"]),
+]
+
+# Entity vocabularies used before the sheet is loaded; the distinct values in the sheet are added to these
+DEFAULT_MACHINE_NAMES = ["cnc machine", "lathe machine", "milling machine", "grinding machine", "drilling machine"]
+DEFAULT_TECHNICIAN_NAMES = ["rajesh", "suresh", "vikram", "gopal", "sanjay", "manoj", "anil"]
+DEFAULT_ISSUES = ["bearing failure", "spindle overheating", "unexpected shutdown", "excessive vibration", "chatter marks"]
+
+MONTHS = ["january", "february", "march", "april", "may", "june", "july", "august", "september", "october", "november", "december"]
+MONTH_NAMES = sorted(MONTHS + [month[:3] for month in MONTHS] + ["sept"], key=len, reverse=True)
+DATE_EXPRESSION = r"(\d{1,2}/\d{1,2}/\d{4}|\d{4}-\d{1,2}-\d{1,2}|(?:" + "|".join(MONTH_NAMES) + r")\b(?:\s+\d{4})?|\d{4})"
+DATE_RANGE_PATTERN = re.compile(
+    r"\b(?:(?P<range>between|from)\s+" + DATE_EXPRESSION + r"\s+(?:and|to)\s+" + DATE_EXPRESSION
+    + r"|(?P<bound>since|after|before|until|in|from)\s+" + DATE_EXPRESSION + r")\b"
+)
+
+# First and last day (as ordinals) covered by a date expression such as "03/15/2024", "march", "march 2024" or "2024".
+# A month without a year means `year` if given, otherwise its most recent occurrence.
+def date_expression_bounds(text, today, year=None):
+    text = text.strip()
+    if text.isdigit():
+        year = int(text)
+        return date(year, 1, 1).toordinal(), date(year, 12, 31).toordinal()
+    ordinal = parse_repair_date(text)
+    if ordinal:
+        return ordinal, ordinal
+    parts = text.split()
+    month = [name[:3] for name in MONTHS].index(parts[0][:3]) + 1
+    if len(parts) > 1:
+        year = int(parts[1])
+    elif year is None:
+        year = today.year if month <= today.month else today.year - 1
+    next_month = date(year + 1, 1, 1) if month == 12 else date(year, month + 1, 1)
+    return date(year, month, 1).toordinal(), next_month.toordinal() - 1
+
+# Extract a date range like "since March", "before 2024-05-01", "in 2024" or "between Jan and Mar 2024".
+# Returns (start ordinal or None, end ordinal or None, matched text), or None when the query has no date range.
+def extract_date_range(query, today=None):
+    today = today or date.today()
+    start = end = None
+    labels = []
+    for match in DATE_RANGE_PATTERN.finditer(query.lower()):
+        try:
+            if match.group("range"):
+                end = date_expression_bounds(match.group(3), today)[1]
+                # "between jan and mar 2024": a bare month takes the year of the end of the range,
+                # or the year before when the range wraps around new year ("between nov and feb 2024")
+                year = date.fromordinal(end).year
+                start = date_expression_bounds(match.group(2), today, year)[0]
+                if start > end:
+                    start = date_expression_bounds(match.group(2), today, year - 1)[0]
+            else:
+                first, last = date_expression_bounds(match.group(5), today)
+                bound = match.group("bound")
+                if bound in ("since", "from"):
+                    start = first
+                elif bound == "after":
+                    start = last + 1
+                elif bound == "before":
+                    end = first - 1
+                elif bound == "until":
+                    end = last
+                else:
+                    start, end = first, last
+        except ValueError:
+            continue
+        labels.append(match.group(0))
+    if not labels:
+        return None
+    return start, end, " ".join(labels)
+
+# Single-pass intent and entity extractor.
+# All keywords and entity names are compiled into one alternation regex wrapped in a lookahead,
+# so one scan over the lowercased message finds every term, including overlapping ones.
+class QueryMatcher:
+    MACHINE_ID_PATTERN = r"mm\d{3}"
+
+    def __init__(self, machine_names=(), technician_names=(), issues=()):
+        # term -> list of (kind, value) it stands for
+        self.terms = defaultdict(list)
+        for intent, keywords in INTENT_KEYWORDS:
+            for keyword in keywords:
+                self.terms[keyword].append(("intent", intent))
+        for column, keywords in COLUMN_KEYWORDS:
+            for keyword in keywords:
+                self.terms[keyword].append(("column", column))
+        for kind, names in (("machine_name", machine_names), ("technician_name", technician_names), ("issue", issues)):
+            for name in names:
+                if len(name) >= 3:
+                    self.terms[name].append((kind, name))
+
+        # Only the longest term is matched at each position, so a term also
+        # carries the meaning of every shorter term it starts with. Looking up each
+        # of a term's own prefixes keeps this linear in the number of terms.
+        ordered = sorted(self.terms, key=len, reverse=True)
+        self.meanings = {
+            term: [
+                meaning
+                for length in range(len(term), 0, -1)
+                if term[:length] in self.terms
+                for meaning in self.terms[term[:length]]
+            ]
+            for term in ordered
+        }
+        alternatives = [self.MACHINE_ID_PATTERN] + [re.escape(term) for term in ordered]
+        self.pattern = re.compile("(?=(" + "|".join(alternatives) + "))")
+        self.intent_priority = {intent: rank for rank, (intent, _) in enumerate(INTENT_KEYWORDS)}
+        self.column_priority = {column: rank for rank, (column, _) in enumerate(COLUMN_KEYWORDS)}
+
+    # Returns the intent, the column asked about and the first occurrence of every entity
+    def parse(self, query):
+        parsed = {
+            "intent": "machine_info",
+            "column": None,
+            "machine_id": None,
+            "machine_name": None,
+            "technician_name": None,
+            "issue": None,
+            "date_range": extract_date_range(query),
+        }
+        intents = set()
+        columns = set()
+        for match in self.pattern.finditer(query.lower()):
+            term = match.group(1)
+            meanings = self.meanings.get(term)
+            if meanings is None:
+                if parsed["machine_id"] is None:
+                    parsed["machine_id"] = term.upper()
+                continue
+            for kind, value in meanings:
+                if kind == "intent":
+                    intents.add(value)
+                elif kind == "column":
+                    columns.add(value)
+                elif parsed[kind] is None:
+                    parsed[kind] = value
+        if intents:
+            parsed["intent"] = min(intents, key=self.intent_priority.get)
+        if columns:
+            parsed["column"] = min(columns, key=self.column_priority.get)
+        return parsed
+
+# (store, vocabulary, matcher) for the current and the incoming snapshot: the refresh thread
+# prepares the next store's matcher while readers may still be on the previous store
+_query_matchers = []
+_query_matchers_lock = threading.Lock()
+
+# Returns the matcher for the current snapshot, rebuilding it only when the sheet data changes.
+# Never loads the sheet itself; before the first load only the default vocabularies are used.
+def get_query_matcher():
+    store = record_store
+    for cached_store, _, matcher in list(_query_matchers):
+        if cached_store is store:
+            return matcher
+    return prepare_query_matcher(store)
+
+# Build (or reuse) the matcher for a store. Called from the refresh thread before a new store
+# is installed, so the chat path normally finds it ready. A store with the same vocabulary as
+# an earlier one (e.g. a full reload of an unchanged sheet) reuses that store's matcher.
+def prepare_query_matcher(store):
+    global _query_matchers
+    machine_names = set(DEFAULT_MACHINE_NAMES)
+    technician_names = set(DEFAULT_TECHNICIAN_NAMES)
+    issues = set(DEFAULT_ISSUES)
+    if store is not None:
+        machine_names.update(store.by_machine_name)
+        technician_names.update(store.by_technician)
+        issues.update(store.by_issue)
+    vocabulary = (frozenset(machine_names), frozenset(technician_names), frozenset(issues))
+    matcher = next((matcher for _, cached_vocabulary, matcher in list(_query_matchers) if cached_vocabulary == vocabulary), None)
+    if matcher is None:
+        matcher = QueryMatcher(machine_names, technician_names, issues)
+    with _query_matchers_lock:
+        _query_matchers = [entry for entry in _query_matchers if entry[0] is not store][-1:] + [(store, vocabulary, matcher)]
+    return matcher
+
+# Parse a user message once into its intent and entities
+def parse_query(query):
+    return get_query_matcher().parse(query)
+
+# Embed texts with Cohere (the default embedding function)
+def cohere_embed(texts, input_type):
+    client = get_cohere_client()
+    vectors = []
+    # The embed endpoint accepts at most 96 texts per call
+    for start in range(0, len(texts), 96):
+        response = client.embed(texts=texts[start:start + 96], model=COHERE_EMBED_MODEL, input_type=input_type)
+        vectors.extend(response.embeddings)
+    return vectors
+
+# Embedding function in use and its name; the name is part of every cache key so
+# vectors from different models (or a local test function) never get mixed up
+_embedding_function = cohere_embed
+_embedding_function_name = f"cohere:{COHERE_EMBED_MODEL}"
+
+# Swap in another embedding function, e.g. a deterministic local one for offline tests.
+# `function(texts, input_type)` must return one vector (list of floats) per text.
+def set_embedding_function(function, name):
+    global _embedding_function, _embedding_function_name
+    _embedding_function = function
+    _embedding_function_name = name
+
+# Persistent embedding cache in a local SQLite file, keyed by a hash of (model, input type, text)
+class EmbeddingCache:
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB)")
+        self.connection.commit()
+
+    def get_many(self, keys):
+        found = {}
+        with self.lock:
+            # Stay well below SQLite's limit on query parameters
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                for key, blob in self.connection.execute(f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", chunk):
+                    found[key] = array("f", blob)
+        return found
+
+    def put_many(self, items):
+        with self.lock:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                [(key, vector.tobytes()) for key, vector in items],
+            )
+            self.connection.commit()
+
+_embedding_cache = None
+# In-memory LRU of recently used embeddings, in front of the on-disk cache
+_recent_embeddings = OrderedDict()
+RECENT_EMBEDDINGS_SIZE = 1024
+_recent_embeddings_lock = threading.Lock()
+
+def get_embedding_cache():
+    global _embedding_cache
+    with _clients_lock:
+        if _embedding_cache is None:
+            _embedding_cache = EmbeddingCache(EMBEDDING_CACHE_PATH)
+    return _embedding_cache
+
+def embedding_key(text, input_type):
+    return hashlib.sha256(f"{_embedding_function_name}\0{input_type}\0{text}".encode("utf-8")).hexdigest()
+
+# Embed texts, only calling the embedding function for texts not found in the LRU or on-disk cache.
+# Returns one array("f") per text.
+def embed_texts(texts, input_type):
+    keys = [embedding_key(text, input_type) for text in texts]
+    vectors = {}
+    with _recent_embeddings_lock:
+        for key in keys:
+            if key in _recent_embeddings:
+                _recent_embeddings.move_to_end(key)
+                vectors[key] = _recent_embeddings[key]
+
+    missing = [key for key in dict.fromkeys(keys) if key not in vectors]
+    if missing:
+        vectors.update(get_embedding_cache().get_many(missing))
+        to_embed = {}
+        for key, text in zip(keys, texts):
+            if key not in vectors:
+                to_embed[key] = text
+        if to_embed:
+            embedded = _embedding_function(list(to_embed.values()), input_type)
+            new_vectors = [(key, array("f", vector)) for key, vector in zip(to_embed, embedded)]
+            get_embedding_cache().put_many(new_vectors)
+            vectors.update(new_vectors)
+        with _recent_embeddings_lock:
+            for key in missing:
+                _recent_embeddings[key] = vectors[key]
+            while len(_recent_embeddings) > RECENT_EMBEDDINGS_SIZE:
+                _recent_embeddings.popitem(last=False)
+
+    return [vectors[key] for key in keys]
+
+def cosine_similarity(a, b):
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+# Example phrasings for each intent, used when a message matches none of the keywords
+INTENT_EXEMPLARS = {
+    "root_cause": [
+        "why does this problem keep happening",
+        "what is the reason behind this failure",
+        "what leads to this fault",
+        "explain why the machine breaks down like this",
+    ],
+    "production_loss": [
+        "how much output did we lose",
+        "how much downtime did we have",
+        "total repair hours and lost production",
+        "what did the breakdowns cost us in production",
+    ],
+    "count": [
+        "how many machines are there",
+        "total machines in the plant",
+        "tell me the machine count",
+    ],
+    "technician_repairs": [
+        "which machines did this technician fix",
+        "show the jobs done by this technician",
+        "what work has this technician done",
+    ],
+    "most_repeated": [
+        "what is the most common problem",
+        "which fault happens most often",
+        "what breaks down the most",
+        "which issue keeps coming back",
+    ],
+    "similar_fixes": [
+        "the machine is making a strange noise, how did we fix it last time",
+        "has this problem happened before and what was done",
+        "find past repairs like this one",
+    ],
+}
+
+_exemplar_vectors = None
+
+# Exemplar embeddings are computed once per embedding function (and cached on disk like any other text)
+def get_exemplar_vectors():
+    global _exemplar_vectors
+    if _exemplar_vectors is None or _exemplar_vectors[0] != _embedding_function_name:
+        labelled = [(intent, text) for intent, texts in INTENT_EXEMPLARS.items() for text in texts]
+        vectors = embed_texts([text for _, text in labelled], "classification")
+        _exemplar_vectors = (_embedding_function_name, [(intent, vector) for (intent, _), vector in zip(labelled, vectors)])
+    return _exemplar_vectors[1]
+
+# Semantic fallback router: returns (intent, score) for the closest exemplar,
+# or (None, score) when nothing is similar enough. Makes a network call on a cache miss.
+def route_query_semantically(query):
+    query_vector = embed_texts([query.lower().strip()], "classification")[0]
+    best_intent, best_score = None, 0.0
+    for intent, vector in get_exemplar_vectors():
+        score = cosine_similarity(query_vector, vector)
+        if score > best_score:
+            best_intent, best_score = intent, score
+    if best_score < SEMANTIC_ROUTER_THRESHOLD:
+        return None, best_score
+    return best_intent, best_score
+
+# Columns combined into the text that is embedded for each repair record
+REPAIR_TEXT_COLUMNS = ["Issue Description", "Root Cause", "Solution Applied", "Additional Notes"]
+
+def repair_text(row):
+    return " | ".join(str(row.get(column, "")).strip() for column in REPAIR_TEXT_COLUMNS if str(row.get(column, "")).strip())
+
+# Exclusive lock shared by every process on the machine, held through a lock file.
+# Where fcntl isn't available (Windows) only the threads of this process are serialized by the caller.
+@contextlib.contextmanager
+def interprocess_lock(path):
+    try:
+        import fcntl
+    except ImportError:
+        fcntl = None
+    with open(path, "a") as f:
+        if fcntl:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+# Vector index over the repair history.
+# Each distinct repair text is embedded once; the normalized float32 vectors are appended to a
+# raw matrix file that is memory-mapped for search, with the text keys kept alongside in JSON.
+# New rows are embedded incrementally, vectors for texts no longer in the sheet are skipped until
+# they make up too much of the file, which is then compacted.
+# The whole index belongs to one embedding function and is rebuilt when another one is set.
+# Every chat worker shares the directory: changes are made under a lock file, starting from the index
+# as the other workers left it, and the vector file is only ever appended to or replaced, so the
+# file a process has mapped always matches the keys it read with it.
+class RepairVectorIndex:
+    def __init__(self, directory):
+        self.directory = directory
+        self.vectors_path = os.path.join(directory, "vectors.f32")
+        self.meta_path = os.path.join(directory, "index.json")
+        self.lock_path = os.path.join(directory, "index.lock")
+        self.lock = threading.Lock()
+        self.embedding_function = _embedding_function_name
+        self.keys = []
+        self.dimension = 0
+        self.matrix = None
+        self.store = None
+        # text key -> row positions in self.store
+        self.positions_by_key = {}
+        os.makedirs(directory, exist_ok=True)
+        with interprocess_lock(self.lock_path):
+            self._load()
+
+    # Adopt the index as it is on disk; call with the lock file held
+    def _load(self):
+        meta = None
+        if os.path.exists(self.meta_path) and os.path.exists(self.vectors_path):
+            with open(self.meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+        if meta is None or meta.get("embedding_function") != self.embedding_function:
+            # Missing, or built with another model whose vectors can't be compared with new ones
+            self.keys = []
+            self.dimension = 0
+            self.matrix = None
+            return
+        self.keys = meta["keys"]
+        self.dimension = meta["dimension"]
+        self._map()
+
+    def _map(self):
+        if self.keys:
+            self.matrix = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(len(self.keys), self.dimension))
+        else:
+            self.matrix = None
+
+    def _write_meta(self):
+        temporary_path = self.meta_path + ".tmp"
+        with open(temporary_path, "w", encoding="utf-8") as f:
+            json.dump({"embedding_function": self.embedding_function, "dimension": self.dimension, "keys": self.keys}, f)
+        os.replace(temporary_path, self.meta_path)
+
+    # Forget every vector; the next append replaces the vector file
+    def _reset(self, embedding_function):
+        self.embedding_function = embedding_function
+        self.keys = []
+        self.dimension = 0
+        self.matrix = None
+        self.store = None
+
+    def _append(self, keys, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.where(norms == 0, 1, norms)
+        if not self.keys:
+            self.dimension = vectors.shape[1]
+            self._replace_vectors(vectors)
+        else:
+            with open(self.vectors_path, "ab") as f:
+                f.write(vectors.tobytes())
+        self.keys.extend(keys)
+        self._write_meta()
+        self._map()
+
+    # Swap in a new vector file instead of truncating the old one: searches already running (here
+    # or in other workers) keep their mapping of the old file, which stays readable after the swap
+    def _replace_vectors(self, vectors):
+        temporary_path = self.vectors_path + ".tmp"
+        with open(temporary_path, "wb") as f:
+            f.write(np.ascontiguousarray(vectors).tobytes())
+        os.replace(temporary_path, self.vectors_path)
+
+    # Rewrite the vector file with only the texts still in the sheet
+    def _compact(self, live_keys):
+        live = [column for column, key in enumerate(self.keys) if key in live_keys]
+        self._replace_vectors(self.matrix[live])
+        removed = len(self.keys) - len(live)
+        self.keys = [self.keys[column] for column in live]
+        self._write_meta()
+        self._map()
+        print(f"🧹 Compacted the repair index, dropping {removed} vectors no longer in the sheet.")
+
+    # Bring the index up to date with a record store, embedding only texts it hasn't seen yet
+    def update(self, store, batch_size=96):
+        with self.lock:
+            embedding_function, function_name = _embedding_function, _embedding_function_name
+            if function_name != self.embedding_function:
+                # Vectors from another model can't be compared with the new query vectors
+                print(f"🧠 Embedding function changed to {function_name}; rebuilding the repair index.")
+                self._reset(function_name)
+            if store is self.store:
+                return
+            positions_by_key = defaultdict(list)
+            texts = {}
+            for position, row in enumerate(store.rows):
+                text = repair_text(row)
+                if not text:
+                    continue
+                key = hashlib.sha256(text.encode("utf-8")).hexdigest()
+                positions_by_key[key].append(position)
+                texts[key] = text
+            os.makedirs(self.directory, exist_ok=True)
+            with interprocess_lock(self.lock_path):
+                # Pick up what other workers appended or compacted since this process last looked
+                self._load()
+                known = set(self.keys)
+                missing = [key for key in texts if key not in known]
+                for start in range(0, len(missing), batch_size):
+                    batch = missing[start:start + batch_size]
+                    self._append(batch, embedding_function([texts[key] for key in batch], "search_document"))
+                if missing:
+                    print(f"🧠 Embedded {len(missing)} new repair records for similarity search.")
+                dead = len(self.keys) - len(texts)
+                if self.keys and dead > REPAIR_INDEX_MAX_DEAD_FRACTION * len(self.keys):
+                    self._compact(texts)
+            self.store = store
+            self.positions_by_key = dict(positions_by_key)
+
+    # Batched top-k cosine search: returns, for each query vector, a list of (score, positions)
+    def search(self, query_vectors, top_k=5):
+        with self.lock:
+            matrix = self.matrix
+            positions_by_key = self.positions_by_key
+            keys = self.keys
+        results = [[] for _ in query_vectors]
+        if matrix is None or not positions_by_key:
+            return results
+        queries = np.asarray(query_vectors, dtype=np.float32)
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        queries = queries / np.where(norms == 0, 1, norms)
+        # Vectors for texts that are no longer in the sheet are masked out
+        live = np.fromiter((key in positions_by_key for key in keys), dtype=bool, count=len(keys))
+        scores = queries @ matrix.T
+        scores[:, ~live] = -np.inf
+        k = min(top_k, int(live.sum()))
+        if k == 0:
+            return results
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        for query_index, candidates in enumerate(top):
+            ranked = sorted(candidates, key=lambda column: -scores[query_index, column])
+            results[query_index] = [(float(scores[query_index, column]), positions_by_key[keys[column]]) for column in ranked]
+        return results
+
+_repair_index = None
+
+def get_repair_index():
+    global _repair_index
+    with _clients_lock:
+        if _repair_index is None:
+            _repair_index = RepairVectorIndex(REPAIR_INDEX_DIR)
+    return _repair_index
+
+# Find past repairs similar to each query in one batched search.
+# Returns a list (one per query) of matches with the repair details, the machines it applied to and the similarity.
+@timed("similarity_search")
+def find_similar_repairs_batch(queries, top_k=5):
+    store = get_record_store()
+    if not store:
+        return [[] for _ in queries]
+    index = get_repair_index()
+    index.update(store)
+    query_vectors = embed_texts([query.lower().strip() for query in queries], "search_query")
+    results = []
+    for matches in index.search(query_vectors, top_k):
+        similar = []
+        for score, positions in matches:
+            records = store.rows_at(positions)
+            similar.append({
+                "Issue Description": records[0].get("Issue Description", "N/A"),
+                "Root Cause": records[0].get("Root Cause", "N/A"),
+                "Solution Applied": records[0].get("Solution Applied", "N/A"),
+                "Additional Notes": records[0].get("Additional Notes", ""),
+                "Machines": list(dict.fromkeys(f"{row.get('ID', 'N/A')} ({row.get('Machine Name', 'N/A')})" for row in records)),
+                "Occurrence Count": len(records),
+                "Similarity": score,
+            })
+        results.append(similar)
+    return results
+
+# Function to find past repairs similar to a free-text problem description
+def find_similar_repairs(query, top_k=5):
+    return find_similar_repairs_batch([query], top_k)[0]
+
 # Function to get the latest record for a Machine ID
+@timed("lookup")
 def get_latest_machine_info(machine_id):
-    data = get_machine_issues()
-    if not data:
+    store = get_record_store()
+    if not store:
         return None
-    machine_records = [row for row in data if row.get("ID", "").upper() == machine_id.upper()]
-    if not machine_records:
+    # O(log n) lookup in the machine's pre-sorted timeline
+    position = store.latest_position(machine_id)
+    if position is None:
         return None
-    latest_record = max(machine_records, key=lambda x: datetime.strptime(x.get("Date of Repair", ""), "%m/%d/%Y"))
+    latest_record = store.rows[position]
     return latest_record
 
+# Function to get the repairs of a Machine ID ordered by date, optionally within [start, end] (date ordinals)
+@timed("lookup")
+def get_machine_history(machine_id, start=None, end=None):
+    store = get_record_store()
+    if not store:
+        return None
+    return store.rows_at(store.timeline_positions(machine_id, start, end))
+
 # Function to get specific column data for a Machine ID
+@timed("lookup")
 def get_column_data(machine_id, column_name):
-    data = get_machine_issues()
-    if not data:
+    store = get_record_store()
+    if not store:
         return None
-    machine_records = [row for row in data if row.get("ID", "").upper() == machine_id.upper()]
+    machine_records = store.find_by_id(machine_id)
     if not machine_records:
         return None
-    column_data = [row.get(column_name, "N/A") for row in machine_records]
+    column_data = list(iter_column_data(machine_records, column_name))
     return column_data
 
-# Function to get the most repeated issue(s) across all machines or for a specific machine
-def get_most_repeated_issue(machine_id=None, machine_name=None):
-    data = get_machine_issues()
-    if not data:
+# Generator over one column of the given records
+def iter_column_data(records, column_name):
+    for row in records:
+        yield row.get(column_name, "N/A")
+
+# Function to get the most repeated issue(s) across all machines or for a specific machine, machine type or technician
+@timed("aggregation")
+def get_most_repeated_issue(machine_id=None, machine_name=None, technician_name=None):
+    store = get_record_store()
+    if not store:
         return None
+    # Read the materialized view for the slice instead of scanning its records
     if machine_id:
-        machine_records = [row for row in data if row.get("ID", "").upper() == machine_id.upper()]
+        view = store.view("by_id", machine_id)
     elif machine_name:
-        machine_records = [row for row in data if row.get("Machine Name", "").lower() == machine_name.lower()]
+        view = store.view("by_machine_name", machine_name)
+    elif technician_name:
+        view = store.view("by_technician", technician_name)
     else:
-        machine_records = data
-
-    if not machine_records:
-        return None
+        view = store.view()
 
-    # Count occurrences of each issue
-    issue_counter = Counter(row.get("Issue Description", "N/A") for row in machine_records)
-    if not issue_counter:
+    if not view or not view.issues:
         return None
 
     # Find the most repeated issue(s)
-    max_count = max(issue_counter.values())
-    most_repeated_issues = [issue for issue, count in issue_counter.items() if count == max_count]
+    ranked_issues = view.top_issues()
+    max_count = ranked_issues[0][1].count
+    most_repeated_issues = [(issue, issue_view) for issue, issue_view in ranked_issues if issue_view.count == max_count]
 
     # Get details for the most repeated issue(s)
     result = []
-    for issue in most_repeated_issues:
-        # Calculate total production loss and total repair time for the issue
-        total_production_loss = sum(
-            float(row.get("Production Loss (%)", "0").replace("%", ""))  # Remove % and convert to float
-            for row in machine_records if row.get("Issue Description", "N/A") == issue
-        )
-        total_repair_time = sum(
-            float(row.get("Time Taken (in hours)", 0))
-            for row in machine_records if row.get("Issue Description", "N/A") == issue
-        )
-
+    for issue, issue_view in most_repeated_issues:
         issue_details = {
             "Issue": issue,
-            "Affected Machines": list(set(row.get("Machine Name", "N/A") for row in machine_records if row.get("Issue Description", "N/A") == issue)),
-            "Root Cause": list(set(row.get("Root Cause", "N/A") for row in machine_records if row.get("Issue Description", "N/A") == issue)),
-            "Solution Applied": list(set(row.get("Solution Applied", "N/A") for row in machine_records if row.get("Issue Description", "N/A") == issue)),
-            "Occurrence Count": issue_counter[issue],
-            "Total Production Loss": total_production_loss,
-            "Total Repair Time": total_repair_time
+            "Affected Machines": list(issue_view.machines),
+            "Root Cause": list(issue_view.root_causes),
+            "Solution Applied": list(issue_view.solutions),
+            "Occurrence Count": issue_view.count,
+            "Total Production Loss": issue_view.production_loss,
+            "Total Repair Time": issue_view.repair_time
         }
         result.append(issue_details)
 
     return result
 
+# Function to get the top N issues for a machine type, technician or Machine ID (or across all machines)
+@timed("aggregation")
+def get_top_issues(machine_name=None, technician_name=None, machine_id=None, top_n=3):
+    store = get_record_store()
+    if not store:
+        return None
+    if machine_id:
+        view = store.view("by_id", machine_id)
+    elif machine_name:
+        view = store.view("by_machine_name", machine_name)
+    elif technician_name:
+        view = store.view("by_technician", technician_name)
+    else:
+        view = store.view()
+    if not view:
+        return None
+    return [
+        {"Issue": issue, "Occurrence Count": issue_view.count, "Total Production Loss": issue_view.production_loss, "Total Repair Time": issue_view.repair_time}
+        for issue, issue_view in view.top_issues(top_n)
+    ]
+
 # Function to count machines by type
+@timed("aggregation")
 def count_machines_by_type(machine_type=None):
-    data = get_machine_issues()
-    if not data:
+    store = get_record_store()
+    if not store:
         return None
 
     if machine_type:
         # Count machines of the specified type
-        machine_count = len([row for row in data if row.get("Machine Name", "").lower() == machine_type.lower()])
+        view = store.view("by_machine_name", machine_type)
+        machine_count = view.count if view else 0
     else:
         # Count all machines
-        machine_count = len(data)
+        machine_count = len(store.rows)
 
     return machine_count
 
 # Function to get machines repaired by a specific technician
+@timed("lookup")
 def get_machines_repaired_by_technician(technician_name):
-    data = get_machine_issues()
-    if not data:
+    store = get_record_store()
+    if not store:
         return None
 
-    # Filter records for the specified technician
-    technician_records = [row for row in data if row.get("Technician Name", "").lower() == technician_name.lower()]
+    # Look up records for the specified technician
+    technician_records = store.find_by_technician(technician_name)
     if not technician_records:
         return None
 
     # Prepare the response
-    result = []
-    for row in technician_records:
-        result.append({
+    result = list(iter_machines_repaired(technician_records))
+
+    return result
+
+# Generator over the machine / issue / solution summary of the given repair records
+def iter_machines_repaired(records):
+    for row in records:
+        yield {
             "Machine Name": row.get("Machine Name", "N/A"),
             "Issue Description": row.get("Issue Description", "N/A"),
             "Solution Applied": row.get("Solution Applied", "N/A")
-        })
+        }
+
+# A long result listing over row positions of a snapshot, rendered one page at a time
+class Listing:
+    def __init__(self, header, store, positions, format_entry, separator=""):
+        self.header = header
+        self.store = store
+        self.positions = positions
+        self.format_entry = format_entry
+        self.separator = separator
+
+    # Generator of text chunks for one page, so entries can be streamed as they are formatted
+    def render_page(self, offset=0, page_size=None):
+        page_size = page_size or RESULTS_PAGE_SIZE
+        end = min(offset + page_size, len(self.positions))
+        yield self.header
+        for number, position in enumerate(self.positions[offset:end]):
+            yield (self.separator if number else "") + self.format_entry(self.store.rows[position])
+        if end < len(self.positions):
+            # Entries without a separator already end with a blank line
+            yield ("\n\n" if self.separator else "") + f"➡️ Showing {offset + 1}-{end} of {len(self.positions)}. Say \"show next {page_size}\" to see more."
+
+def format_machine_repaired(row):
+    return (
+        f"**Machine Name:** {row.get('Machine Name', 'N/A')}\n"
+        f"**Issue Description:** {row.get('Issue Description', 'N/A')}\n"
+        f"**Solution Applied:** {row.get('Solution Applied', 'N/A')}\n\n"
+    )
+
+# Listing of the machines repaired by a technician, or None if there are none
+@timed("lookup")
+def get_technician_listing(technician_name):
+    store = get_record_store()
+    if not store:
+        return None
+    positions = store.positions_by_technician(technician_name)
+    if not positions:
+        return None
+    return Listing(f"🔧 Machines repaired by {technician_name}:\n\n", store, positions, format_machine_repaired)
+
+# Listing of one column's values for a Machine ID, or None if there are no records
+@timed("lookup")
+def get_column_listing(machine_id, column_name, header):
+    store = get_record_store()
+    if not store:
+        return None
+    positions = store.positions_by_id(machine_id)
+    if not positions:
+        return None
+    return Listing(header, store, positions, lambda row: str(row.get(column_name, "N/A")), "\n")
+
+def format_repair_history_entry(row):
+    return (
+        f"**{row.get('Date of Repair', 'N/A')}:** {row.get('Issue Description', 'N/A')} - "
+        f"{row.get('Solution Applied', 'N/A')} ({row.get('Technician Name', 'N/A')})"
+    )
+
+# Listing of a machine's repairs in date order, optionally within [start, end] (date ordinals)
+@timed("lookup")
+def get_history_listing(machine_id, start=None, end=None, label=""):
+    store = get_record_store()
+    if not store:
+        return None
+    positions = store.timeline_positions(machine_id, start, end)
+    if not positions:
+        return None
+    header = f"🔧 Repairs on {machine_id}{' ' + label if label else ''}:\n"
+    return Listing(header, store, positions, format_repair_history_entry, "\n")
+
+# Headers and empty-result messages for the per-column Machine ID listings
+COLUMN_LISTINGS = {
+    "Technician Name": ("Technicians who handled {machine_id}:\n", "No technician records found for {machine_id}."),
+    "Issue Description": ("Issues for {machine_id}:\n", "No issue records found for {machine_id}."),
+    "Root Cause": ("Root causes for {machine_id}:\n", "No root cause records found for {machine_id}."),
+    "Solution Applied": ("Solutions applied to {machine_id}:\n", "No solution records found for {machine_id}."),
+    "Date of Repair": ("Repair dates for {machine_id}:\n", "No repair date records found for {machine_id}."),
+    "Time Taken (in hours)": ("Repair times for {machine_id}:\n", "No repair time records found for {machine_id}."),
+    "Production Loss (%)": ("Production losses for {machine_id}:\n", "No production loss records found for {machine_id}."),
+}
+
+# Cursor for the page after `offset`, or None when the listing is exhausted
+def next_listing_cursor(listing, offset):
+    next_offset = offset + RESULTS_PAGE_SIZE
+    return (listing, next_offset) if next_offset < len(listing.positions) else None
 
-    return result
 # Function to calculate total production loss and repair time for all machines, a specific machine type, or a specific machine ID
+@timed("aggregation")
 def calculate_total_production_loss_and_repair_time(machine_type=None, issue=None, machine_id=None):
-    data = get_machine_issues()
-    if not data:
+    store = get_record_store()
+    if not store:
         return None
 
-    # Filter records based on the specified machine type, issue, or machine ID
+    # Read the materialized view for the specified machine type, issue, or machine ID
     if machine_type:
-        filtered_records = [row for row in data if row.get("Machine Name", "").lower() == machine_type.lower()]
+        view = store.view("by_machine_name", machine_type)
     elif issue:
-        filtered_records = [row for row in data if row.get("Issue Description", "").lower() == issue.lower()]
+        view = store.view("by_issue", issue)
     elif machine_id:
-        filtered_records = [row for row in data if row.get("ID", "").upper() == machine_id.upper()]
+        view = store.view("by_id", machine_id)
     else:
-        filtered_records = data
+        view = store.view()
 
-    if not filtered_records:
+    if not view:
         return None
 
-    # Calculate total production loss and total repair time
-    total_production_loss = 0.0
-    total_repair_time = 0.0
-
-    for row in filtered_records:
-        # Handle production loss
-        production_loss_str = str(row.get("Production Loss (%)", "0")).replace("%", "").strip()
-        if production_loss_str:  # Check if the string is not empty
-            try:
-                total_production_loss += float(production_loss_str)
-            except ValueError:
-                print(f"Warning: Could not convert '{production_loss_str}' to float. Skipping this record.")
-
-        # Handle repair time
-        repair_time_str = str(row.get("Time Taken (in hours)", "0")).strip()
-        if repair_time_str:  # Check if the string is not empty
-            try:
-                total_repair_time += float(repair_time_str)
-            except ValueError:
-                print(f"Warning: Could not convert '{repair_time_str}' to float. Skipping this record.")
-
+    # Totals are kept up to date as rows are loaded (cells that failed to parse count as 0)
     return {
-        "Total Production Loss": total_production_loss,
-        "Total Repair Time": total_repair_time
+        "Total Production Loss": view.production_loss,
+        "Total Repair Time": view.repair_time,
+        "Excluded Cells": view.excluded_cells
     }
 
 # Function to get root cause, affected machines, and solutions for a specific issue
+@timed("aggregation")
 def get_issue_details(issue_description):
-    data = get_machine_issues()
-    if not data:
+    store = get_record_store()
+    if not store:
         return None
 
-    # Filter records for the specified issue description
-    issue_records = [row for row in data if row.get("Issue Description", "").lower() == issue_description.lower()]
-    if not issue_records:
+    # Read the materialized view for the specified issue description
+    view = store.view("by_issue", issue_description)
+    if not view:
         return None
 
     # Prepare the response
     result = {
         "Issue": issue_description,
-        "Affected Machines": list(set(row.get("Machine Name", "N/A") for row in issue_records)),
-        "Root Cause": list(set(row.get("Root Cause", "N/A") for row in issue_records)),
-        "Solution Applied": list(set(row.get("Solution Applied", "N/A") for row in issue_records)),
-        "Occurrence Count": len(issue_records)
+        "Affected Machines": list(view.machines),
+        "Root Cause": list(view.root_causes),
+        "Solution Applied": list(view.solutions),
+        "Occurrence Count": view.count
+    }
+
+    return result
+
+# Entity filters of a parsed query and the SQL key column each one matches (with the same normalization as the indexes)
+SQL_FILTER_COLUMNS = (
+    ("machine_id", "id_key", True),
+    ("machine_name", "machine_key", False),
+    ("technician_name", "technician_key", False),
+    ("issue", "issue_key", False),
+)
+
+# In-memory SQLite copy of a record store for questions that combine several filters.
+# The parsed numbers and dates come from the store, so SQL sums match the materialized views.
+class SQLEngine:
+    def __init__(self, store):
+        self.version = store.version
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(":memory:", check_same_thread=False)
+        self.connection.execute("""
+            CREATE TABLE repairs (
+                position INTEGER PRIMARY KEY,
+                id_key TEXT, machine_key TEXT, technician_key TEXT, issue_key TEXT,
+                repair_date INTEGER, production_loss REAL, repair_time REAL,
+                machine_name, issue, root_cause, solution
+            )
+        """)
+        self.connection.executemany(
+            "INSERT INTO repairs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                (
+                    position,
+                    normalize_key(row.get("ID"), upper=True),
+                    normalize_key(row.get("Machine Name")),
+                    normalize_key(row.get("Technician Name")),
+                    normalize_key(row.get("Issue Description")),
+                    store.repair_dates[position] or None,
+                    store.production_loss[position],
+                    store.repair_time[position],
+                    row.get("Machine Name", "N/A"),
+                    row.get("Issue Description", "N/A"),
+                    row.get("Root Cause", "N/A"),
+                    row.get("Solution Applied", "N/A"),
+                )
+                for position, row in enumerate(store.rows)
+            ),
+        )
+        # Each key is indexed together with the date and both numbers, so a key plus a date range
+        # is one index range scan and the totals are read from the index without visiting the rows
+        for column in ("id_key", "machine_key", "technician_key", "issue_key"):
+            self.connection.execute(f"CREATE INDEX repairs_{column} ON repairs ({column}, repair_date, production_loss, repair_time)")
+        self.connection.execute("CREATE INDEX repairs_repair_date ON repairs (repair_date, production_loss, repair_time)")
+        # Table statistics let SQLite pick the most selective index when several filters are combined
+        self.connection.execute("ANALYZE")
+        self.connection.commit()
+
+    # WHERE clause and parameters for the entities and date range of a parsed query
+    @staticmethod
+    def where(filters):
+        conditions = []
+        params = []
+        for entity, column, upper in SQL_FILTER_COLUMNS:
+            if filters.get(entity):
+                conditions.append(f"{column} = ?")
+                params.append(normalize_key(filters[entity], upper=upper))
+        start, end, _ = filters.get("date_range") or (None, None, "")
+        if start is not None:
+            conditions.append("repair_date >= ?")
+            params.append(start)
+        if end is not None:
+            conditions.append("repair_date <= ?")
+            params.append(end)
+        return ("WHERE " + " AND ".join(conditions)) if conditions else "", params
+
+    def execute(self, sql, params=()):
+        with self.lock:
+            return self.connection.execute(sql, params).fetchall()
+
+    # (repairs, total production loss, total repair time) over the filtered rows
+    def totals(self, filters):
+        where, params = self.where(filters)
+        return self.execute(
+            f"SELECT COUNT(*), COALESCE(SUM(production_loss), 0), COALESCE(SUM(repair_time), 0) FROM repairs {where}",
+            params,
+        )[0]
+
+    # [(issue, occurrences, production loss, repair time)], most frequent first (ties in sheet order)
+    def issues(self, filters):
+        where, params = self.where(filters)
+        return self.execute(
+            f"SELECT issue, COUNT(*), SUM(production_loss), SUM(repair_time) FROM repairs {where} "
+            f"GROUP BY issue ORDER BY COUNT(*) DESC, MIN(position)",
+            params,
+        )
+
+    # Distinct values of one label column over the filtered rows, in order of first appearance
+    def distinct(self, column, filters, issue=None):
+        where, params = self.where(filters)
+        if issue is not None:
+            where = f"{where} AND issue = ?" if where else "WHERE issue = ?"
+            params = params + [issue]
+        rows = self.execute(f"SELECT {column} FROM repairs {where} GROUP BY {column} ORDER BY MIN(position)", params)
+        return [value for value, in rows]
+
+_sql_engine = None
+_sql_engine_lock = threading.Lock()
+
+# Returns the SQL engine for the current snapshot, building it on first use after each reload
+def get_sql_engine():
+    global _sql_engine
+    store = get_record_store()
+    if not store:
+        return None
+    with _sql_engine_lock:
+        if _sql_engine is None or _sql_engine.version != store.version:
+            _sql_engine = SQLEngine(store)
+        return _sql_engine
+
+# Intents that can be answered with several filters at once, and the single filter (if any)
+# each one's materialized views already answer. Anything beyond that goes through the SQL engine.
+SQL_FILTERED_INTENTS = {
+    "production_loss": {"machine_name", "issue", "machine_id"},
+    "count": {"machine_name"},
+    "most_repeated": {"machine_id", "machine_name", "technician_name"},
+    "root_cause": {"issue"},
+}
+
+# Whether a parsed query has filters its intent's materialized views can't answer on their own
+def needs_sql_engine(intent, parsed):
+    if intent not in SQL_FILTERED_INTENTS:
+        return False
+    filters = [entity for entity, _, _ in SQL_FILTER_COLUMNS if parsed[entity]]
+    if parsed["date_range"]:
+        filters.append("date_range")
+    return len(filters) > 1 or (len(filters) == 1 and filters[0] not in SQL_FILTERED_INTENTS[intent])
+
+# Human-readable description of the filters of a parsed query, e.g. "lathe machine repaired by vikram in 2024"
+def describe_filters(parsed, subject=None):
+    parts = [subject or parsed["machine_id"] or parsed["machine_name"] or "all machines"]
+    if parsed["issue"]:
+        parts.append(f"due to {parsed['issue']}")
+    if parsed["technician_name"]:
+        parts.append(f"repaired by {parsed['technician_name']}")
+    if parsed["date_range"]:
+        parts.append(parsed["date_range"][2])
+    return " ".join(parts)
+
+# Function to total production loss and repair time over every filter of a query
+@timed("aggregation")
+def query_totals(filters):
+    engine = get_sql_engine()
+    if not engine:
+        return None
+    repairs, production_loss, repair_time = engine.totals(filters)
+    if not repairs:
+        return None
+    return {
+        "Repairs": repairs,
+        "Total Production Loss": production_loss,
+        "Total Repair Time": repair_time
+    }
+
+# Function to count the repairs matching every filter of a query
+@timed("aggregation")
+def query_repair_count(filters):
+    engine = get_sql_engine()
+    if not engine:
+        return None
+    return engine.totals(filters)[0]
+
+# Function to get the details of the filtered query's issue (root cause, machines, solutions)
+@timed("aggregation")
+def query_issue_details(filters):
+    engine = get_sql_engine()
+    if not engine:
+        return None
+    repairs = engine.totals(filters)[0]
+    if not repairs:
+        return None
+    return {
+        "Issue": filters["issue"],
+        "Affected Machines": engine.distinct("machine_name", filters),
+        "Root Cause": engine.distinct("root_cause", filters),
+        "Solution Applied": engine.distinct("solution", filters),
+        "Occurrence Count": repairs
     }
 
+# Function to get the most repeated issue(s) among the rows matching every filter of a query
+@timed("aggregation")
+def query_most_repeated_issues(filters):
+    engine = get_sql_engine()
+    if not engine:
+        return None
+    ranked_issues = engine.issues(filters)
+    if not ranked_issues:
+        return None
+    max_count = ranked_issues[0][1]
+    result = []
+    for issue, count, production_loss, repair_time in ranked_issues:
+        if count != max_count:
+            break
+        result.append({
+            "Issue": issue,
+            "Affected Machines": engine.distinct("machine_name", filters, issue),
+            "Root Cause": engine.distinct("root_cause", filters, issue),
+            "Solution Applied": engine.distinct("solution", filters, issue),
+            "Occurrence Count": count,
+            "Total Production Loss": production_loss,
+            "Total Repair Time": repair_time
+        })
     return result
 
-# Main function to handle user queries
+# Send a chat message, timed as the "send" stage
+async def send_message(content):
+    with trace_span("send"):
+        await cl.Message(content=content).send()
+
+# Base for the objects handle_query replies through. A listing page is sent as a stream of
+# chunks plus the cursor for "show next", which is kept in the replier's session.
+class Replier:
+    async def send_listing(self, listing, offset=0):
+        await self.send_page(listing.render_page(offset), next_listing_cursor(listing, offset))
+
+# Replies to the Chainlit UI for the current user session
+class ChainlitReplier(Replier):
+    def __init__(self):
+        self.session = cl.user_session
+
+    async def send(self, content):
+        await send_message(content)
+
+    # Stream one page into a chat message and keep the cursor in the user session
+    async def send_page(self, chunks, cursor):
+        msg = cl.Message(content="")
+        for chunk in chunks:
+            with trace_span("send"):
+                await msg.stream_token(chunk)
+        with trace_span("send"):
+            await msg.send()
+        self.session.set("listing_cursor", cursor)
+
+# Plain dict with the get/set interface of cl.user_session, for running queries outside Chainlit
+class LocalSession(dict):
+    def set(self, key, value):
+        self[key] = value
+
+# Collects replies in memory instead of sending them (benchmarks and offline runs)
+class ReplyCollector(Replier):
+    def __init__(self, session=None):
+        self.session = session if session is not None else LocalSession()
+        self.messages = []
+
+    async def send(self, content):
+        self.messages.append(content)
+
+    async def send_page(self, chunks, cursor):
+        self.messages.append("".join(chunks))
+        self.session.set("listing_cursor", cursor)
+
+# Forwards replies to another replier while recording them for the response cache
+class RecordingReplier(Replier):
+    def __init__(self, replier):
+        self.replier = replier
+        self.session = replier.session
+        self.replies = []
+
+    async def send(self, content):
+        self.replies.append(("message", content, None))
+        await self.replier.send(content)
+
+    async def send_page(self, chunks, cursor):
+        recorded = []
+
+        # Record the chunks as they stream so the page is still sent incrementally
+        def record(chunks):
+            for chunk in chunks:
+                recorded.append(chunk)
+                yield chunk
+
+        await self.replier.send_page(record(chunks), cursor)
+        self.replies.append(("page", "".join(recorded), cursor))
+
+# LRU cache of finished answers, keyed by intent and entities and stamped with the data version.
+# Entries from an older snapshot are dropped as soon as a newer version is seen.
+class ResponseCache:
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _check_version(self, version):
+        if version > self.version:
+            self.entries.clear()
+            self.version = version
+        return version == self.version
+
+    def get(self, version, key):
+        with self.lock:
+            replies = self.entries.get(key) if self._check_version(version) else None
+            if replies is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return replies
+
+    def put(self, version, key, replies):
+        if self.max_entries <= 0:
+            return
+        with self.lock:
+            # An answer computed from an older snapshot is never stored
+            if not self._check_version(version):
+                return
+            self.entries[key] = replies
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+response_cache = ResponseCache(RESPONSE_CACHE_SIZE)
+
+# Intents whose answers depend on more than the intent and entities (session cursor, raw query text)
+UNCACHED_INTENTS = {"next_page", "similar_fixes"}
+
+# Cache key of a parsed query: the intent plus its normalized entities
+def response_cache_key(intent, parsed):
+    return (
+        intent,
+        normalize_key(parsed["machine_id"], upper=True),
+        normalize_key(parsed["machine_name"]),
+        normalize_key(parsed["technician_name"]),
+        normalize_key(parsed["issue"]),
+        parsed["column"],
+        parsed["date_range"],
+    )
+
+# Send cached replies again; listing pages also restore their "show next" cursor
+async def replay_replies(replier, replies):
+    for kind, content, cursor in replies:
+        if kind == "page":
+            await replier.send_page([content], cursor)
+        else:
+            await replier.send(content)
+
+# Answer a query without the Chainlit UI; returns the reply messages and the finished trace
+async def answer_query(user_query, session=None):
+    replier = ReplyCollector(session)
+    trace = QueryTrace(user_query)
+    token = _current_trace.set(trace)
+    try:
+        await handle_query(user_query, trace, replier)
+    finally:
+        _current_trace.reset(token)
+        trace.finish()
+    return replier.messages, trace
+
+# Expose the latency metrics in Prometheus format at /metrics on the Chainlit server
+@cl.on_app_startup
+def register_metrics_endpoint():
+    from chainlit.server import app as chainlit_server
+    from starlette.responses import PlainTextResponse
+    from starlette.routing import Route
+
+    async def metrics_endpoint(request):
+        return PlainTextResponse(metrics.render_prometheus())
+
+    # Insert ahead of Chainlit's catch-all UI route so the path isn't swallowed by it
+    chainlit_server.router.routes.insert(0, Route("/metrics", metrics_endpoint, methods=["GET"]))
+
+# Main function to handle user queries: traces every message and, when enabled for the session, profiles it
 @cl.on_message
 async def main(message):
     user_query = message.content
     print(f"🔍 Received Query: {user_query}")
 
+    # "/profile on" and "/profile off" toggle cProfile for this session
+    command = user_query.strip().lower()
+    if command in ("/profile on", "/profile off"):
+        cl.user_session.set("profile", command == "/profile on")
+        await cl.Message(content=f"🧪 Profiling {'enabled' if command == '/profile on' else 'disabled'} for this session.").send()
+        return
+
+    trace = QueryTrace(user_query)
+    token = _current_trace.set(trace)
+    profiler = start_profiler() if cl.user_session.get("profile") else None
+    if cl.user_session.get("profile") and profiler is None:
+        print("🧪 Profiler busy with another message; this one is not profiled.")
+    try:
+        await handle_query(user_query, trace, ChainlitReplier())
+    finally:
+        if profiler:
+            stop_profiler(profiler)
+        _current_trace.reset(token)
+        total = trace.finish()
+        print(f"⏱️ {trace.intent} answered in {total * 1000:.1f} ms")
+        if profiler and total >= SLOW_QUERY_SECONDS:
+            save_profile(profiler, trace)
+
+# Only one profiler can be active per process (Python 3.12+ refuses a second one, older versions let it
+# take over the first one's hook), so concurrent profiled messages take turns and the others run unprofiled
+_profiler_lock = threading.Lock()
+
+# Returns an enabled profiler, or None if another message is already being profiled
+def start_profiler():
+    if not _profiler_lock.acquire(blocking=False):
+        return None
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Another profiling tool (e.g. a debugger or an outside profiler) is active
+        _profiler_lock.release()
+        return None
+    return profiler
+
+def stop_profiler(profiler):
+    profiler.disable()
+    _profiler_lock.release()
+
+# Save a cProfile dump of a slow message and print its top functions.
+# The profiler runs on the event loop thread, so it also sees other sessions' work during awaits.
+def save_profile(profiler, trace):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{trace.intent}.prof")
+    profiler.dump_stats(path)
+    output = io.StringIO()
+    pstats.Stats(profiler, stream=output).sort_stats("cumulative").print_stats(15)
+    print(f"🧪 Slow query ({trace.spans['total']:.2f} s) profiled to {path}:\n{output.getvalue()}")
+
+# Answer one user query, recording timing spans into `trace`
+async def handle_query(user_query, trace, replier):
+    # Load the sheet data off the event loop so a cold cache doesn't stall other sessions
+    trace.labels["cache"] = "hit" if record_store is not None else "miss"
+    metrics.increment("chat_data_cache_total", [("result", trace.labels["cache"])])
+    try:
+        with trace.span("data_fetch"):
+            store = await get_record_store_async()
+    except Exception as e:
+        print(f"⚠️ Could not load maintenance data: {e}")
+        await replier.send("❌ The maintenance data is not available right now. Please try again later.")
+        return
+
+    # Extract the intent and all entities from the message in a single pass
+    with trace.span("intent"):
+        parsed = parse_query(user_query)
+        intent = parsed["intent"]
+
+        # No keyword matched and there is no Machine ID: try the semantic router before giving up
+        if intent == "machine_info" and not parsed["machine_id"]:
+            try:
+                routed_intent, score = await asyncio.to_thread(route_query_semantically, user_query)
+                print(f"🧭 Semantic routing: {routed_intent} (score {score:.2f})")
+                if routed_intent:
+                    intent = routed_intent
+            except Exception as e:
+                print(f"⚠️ Semantic routing unavailable: {e}")
+    trace.intent = intent
+
+    # Repeated questions on the same data version are answered from the response cache
+    if intent in UNCACHED_INTENTS or response_cache.max_entries <= 0:
+        await answer_intent(user_query, intent, parsed, replier)
+        return
+    key = response_cache_key(intent, parsed)
+    version = store.version if store else 0
+    replies = response_cache.get(version, key)
+    trace.labels["response_cache"] = "hit" if replies is not None else "miss"
+    metrics.increment("chat_response_cache_total", [("result", trace.labels["response_cache"])])
+    if replies is not None:
+        await replay_replies(replier, replies)
+        return
+    recorder = RecordingReplier(replier)
+    await answer_intent(user_query, intent, parsed, recorder)
+    response_cache.put(version, key, recorder.replies)
+
+# Compute and send the answer for a parsed query
+async def answer_intent(user_query, intent, parsed, replier):
+    # Continue the last long listing in this session from its saved cursor
+    if intent == "next_page":
+        cursor = replier.session.get("listing_cursor")
+        if not cursor:
+            await replier.send("❌ There is nothing more to show.")
+            return
+        listing, offset = cursor
+        await replier.send_listing(listing, offset)
+        return
+
+    # Questions combining several filters (e.g. a machine type, a technician and a date range) go through the SQL engine
+    if needs_sql_engine(intent, parsed) and (intent != "root_cause" or parsed["issue"]):
+        await answer_filtered_intent(intent, parsed, replier)
+        return
+
     # Step 5: Handle queries related to the root cause of a specific issue
-    if "root cause" in user_query.lower() or "cause of" in user_query.lower() or "what causes" in user_query.lower():
-        # Extract issue description from the query
-        issue_description = extract_issue(user_query)
+    if intent == "root_cause":
+        issue_description = parsed["issue"]
         if not issue_description:
-            await cl.Message(content="❌ Please provide a valid issue description.").send()
+            await replier.send("❌ Please provide a valid issue description.")
             return
 
         # Get issue details
         issue_details = get_issue_details(issue_description)
         if not issue_details:
-            await cl.Message(content=f"❌ No records found for the issue: {issue_description}.").send()
+            await replier.send(f"❌ No records found for the issue: {issue_description}.")
             return
 
         # Prepare the response
@@ -301,20 +2499,19 @@ async def main(message):
             f"🔧 Solution(s) Applied: {', '.join(issue_details['Solution Applied'])}"
         )
 
-        await cl.Message(content=response).send()
+        await replier.send(response)
         return
 
     # Step 4: Calculate total production loss and repair time
-    if "production loss" in user_query.lower() or "hours taken" in user_query.lower():
-        # Extract machine type, issue, or machine ID from the query
-        machine_type = extract_machine_name(user_query)
-        issue = extract_issue(user_query)
-        machine_id = extract_machine_id(user_query)
+    if intent == "production_loss":
+        machine_type = parsed["machine_name"]
+        issue = parsed["issue"]
+        machine_id = parsed["machine_id"]
 
         # Calculate total production loss and repair time
         result = calculate_total_production_loss_and_repair_time(machine_type, issue, machine_id)
         if not result:
-            await cl.Message(content="❌ No data found for the specified query.").send()
+            await replier.send("❌ No data found for the specified query.")
             return
 
         # Prepare the response
@@ -338,19 +2535,20 @@ async def main(message):
                 f"🔧 Total Production Loss for all machines: {result['Total Production Loss']}%\n"
                 f"🔧 Total Repair Time for all machines: {result['Total Repair Time']} hours"
             )
+        if result["Excluded Cells"]:
+            response += f"\n⚠️ {result['Excluded Cells']} value(s) that could not be parsed were left out of these totals."
 
-        await cl.Message(content=response).send()
+        await replier.send(response)
         return
 
     # Step 3: Count machines by type or total machines
-    if "count" in user_query.lower() or "number of" in user_query.lower() or "how many" in user_query.lower():
-        # Extract machine type from the query
-        machine_type = extract_machine_name(user_query)
+    if intent == "count":
+        machine_type = parsed["machine_name"]
 
         # Get the count of machines
         machine_count = count_machines_by_type(machine_type)
         if machine_count is None:
-            await cl.Message(content="❌ No data found for the specified machine type.").send()
+            await replier.send("❌ No data found for the specified machine type.")
             return
 
         # Prepare the response
@@ -359,45 +2557,36 @@ async def main(message):
         else:
             response = f"Total number of machines: {machine_count}"
 
-        await cl.Message(content=response).send()
+        await replier.send(response)
         return
 
     # Step 3: Machines repaired by a specific technician
-    if "repaired by" in user_query.lower() or "handled by" in user_query.lower():
-        # Extract technician name from the query
-        technician_name = extract_technician_name(user_query)
+    if intent == "technician_repairs":
+        technician_name = parsed["technician_name"]
         if not technician_name:
-            await cl.Message(content="❌ Please provide a valid technician name.").send()
+            await replier.send("❌ Please provide a valid technician name.")
             return
 
         # Get machines repaired by the technician
-        machines_repaired = get_machines_repaired_by_technician(technician_name)
+        machines_repaired = get_technician_listing(technician_name)
         if not machines_repaired:
-            await cl.Message(content=f"❌ No machines repaired by {technician_name} found.").send()
+            await replier.send(f"❌ No machines repaired by {technician_name} found.")
             return
 
-        # Prepare the response
-        response = f"🔧 Machines repaired by {technician_name}:\n\n"
-        for machine in machines_repaired:
-            response += (
-                f"**Machine Name:** {machine['Machine Name']}\n"
-                f"**Issue Description:** {machine['Issue Description']}\n"
-                f"**Solution Applied:** {machine['Solution Applied']}\n\n"
-            )
-
-        await cl.Message(content=response).send()
+        # Stream the first page of the response
+        await replier.send_listing(machines_repaired)
         return
 
     # Step 2: Most repeated issue(s)
-    if "most repeated" in user_query.lower() or "most occured" in user_query.lower() or "repeated problem" in user_query.lower():
-        # Extract Machine ID or Machine Name from the query
-        machine_id = extract_machine_id(user_query)
-        machine_name = extract_machine_name(user_query)
+    if intent == "most_repeated":
+        machine_id = parsed["machine_id"]
+        machine_name = parsed["machine_name"]
+        technician_name = parsed["technician_name"]
 
         # Get the most repeated issue(s)
-        most_repeated_issues = get_most_repeated_issue(machine_id, machine_name)
+        most_repeated_issues = get_most_repeated_issue(machine_id, machine_name, technician_name)
         if not most_repeated_issues:
-            await cl.Message(content="❌ No repeated issues found.").send()
+            await replier.send("❌ No repeated issues found.")
             return
 
         # Prepare the response
@@ -413,85 +2602,283 @@ async def main(message):
                 f"**Total Repair Time:** {issue['Total Repair Time']} hours\n\n"
             )
 
-        await cl.Message(content=response).send()
+        await replier.send(response)
+        return
+
+    # Repair history of a machine, optionally limited to a date range
+    if intent == "repair_history":
+        machine_id = parsed["machine_id"]
+        if not machine_id:
+            await replier.send("❌ Please provide a valid Machine ID (e.g., MM001).")
+            return
+        start, end, label = parsed["date_range"] or (None, None, "")
+        listing = get_history_listing(machine_id, start, end, label)
+        if not listing:
+            await replier.send(f"❌ No repairs found for {machine_id}{' ' + label if label else ''}.")
+            return
+        await replier.send_listing(listing)
+        return
+
+    # Similar past fixes for a free-text problem description
+    if intent == "similar_fixes":
+        try:
+            similar_repairs = await asyncio.to_thread(find_similar_repairs, user_query)
+        except Exception as e:
+            print(f"⚠️ Similarity search unavailable: {e}")
+            await replier.send("❌ Similarity search is not available right now.")
+            return
+        if not similar_repairs:
+            await replier.send("❌ No similar past repairs found.")
+            return
+
+        # Prepare the response
+        response = "🔧 Similar Past Repairs:\n\n"
+        for repair in similar_repairs:
+            response += (
+                f"**Issue:** {repair['Issue Description']}\n"
+                f"**Root Cause:** {repair['Root Cause']}\n"
+                f"**Solution Applied:** {repair['Solution Applied']}\n"
+                f"**Machines:** {', '.join(repair['Machines'])}\n"
+                f"**Similarity:** {repair['Similarity']:.2f}\n\n"
+            )
+
+        await replier.send(response)
         return
 
     # Step 1 functionality (unchanged)
-    machine_id = extract_machine_id(user_query)
+    machine_id = parsed["machine_id"]
     if not machine_id:
-        await cl.Message(content="❌ Please provide a valid Machine ID (e.g., MM001).").send()
+        await replier.send("❌ Please provide a valid Machine ID (e.g., MM001).")
         return
 
     # Fetch the latest record for the Machine ID
     latest_record = get_latest_machine_info(machine_id)
     if not latest_record:
-        await cl.Message(content=f"❌ No records found for Machine ID: {machine_id}.").send()
+        await replier.send(f"❌ No records found for Machine ID: {machine_id}.")
         return
 
     # Check if the query is asking for specific column data
-    if "technician" in user_query.lower() or "name of technician" in user_query.lower() or "who handled" in user_query.lower():
-        # Get all technician names for the Machine ID
-        technicians = get_column_data(machine_id, "Technician Name")
-        if technicians:
-            response = f"Technicians who handled {machine_id}:\n" + "\n".join(technicians)
-        else:
-            response = f"No technician records found for {machine_id}."
-    elif "issue" in user_query.lower():
-        # Get all issue descriptions for the Machine ID
-        issues = get_column_data(machine_id, "Issue Description")
-        if issues:
-            response = f"Issues for {machine_id}:\n" + "\n".join(issues)
-        else:
-            response = f"No issue records found for {machine_id}."
-    elif "root cause"  in user_query.lower():
-        # Get all root causes for the Machine ID
-        root_causes = get_column_data(machine_id, "Root Cause")
-        if root_causes:
-            response = f"Root causes for {machine_id}:\n" + "\n".join(root_causes)
-        else:
-            response = f"No root cause records found for {machine_id}."
-    elif "solution" in user_query.lower():
-        # Get all solutions applied for the Machine ID
-        solutions = get_column_data(machine_id, "Solution Applied")
-        if solutions:
-            response = f"Solutions applied to {machine_id}:\n" + "\n".join(solutions)
+    column = parsed["column"]
+    if column:
+        # Stream all values of the column for the Machine ID, one page at a time
+        header, empty_message = COLUMN_LISTINGS[column]
+        listing = get_column_listing(machine_id, column, header.format(machine_id=machine_id))
+        if not listing:
+            await replier.send(empty_message.format(machine_id=machine_id))
+            return
+        await replier.send_listing(listing)
+        return
+
+    # If no specific column is mentioned, return the latest record
+    response = (
+        f"**🔧 Latest Information for {machine_id}:**\n\n"
+        f"**Machine Name:** {latest_record.get('Machine Name', 'N/A')}\n"
+        f"**Issue Description:** {latest_record.get('Issue Description', 'N/A')}\n"
+        f"**Root Cause:** {latest_record.get('Root Cause', 'N/A')}\n"
+        f"**Solution Applied:** {latest_record.get('Solution Applied', 'N/A')}\n"
+        f"**Technician Name:** {latest_record.get('Technician Name', 'N/A')}\n"
+        f"**Date of Repair:** {latest_record.get('Date of Repair', 'N/A')}\n"
+        f"**Time Taken (in hours):** {latest_record.get('Time Taken (in hours)', 'N/A')}\n"
+        f"**Production Loss (%):** {latest_record.get('Production Loss (%)', 'N/A')}\n"
+        f"**Additional Notes:** {latest_record.get('Additional Notes', 'N/A')}"
+    )
+
+    # Send the response back to the Chainlit UI
+    await replier.send(response)
+
+# Answer a production loss, count, most repeated or root cause question with every filter applied.
+# The SQL engine runs in a worker thread: its first use after a reload builds the tables.
+async def answer_filtered_intent(intent, parsed, replier):
+    description = describe_filters(parsed)
+
+    if intent == "production_loss":
+        result = await asyncio.to_thread(query_totals, parsed)
+        if not result:
+            await replier.send(f"❌ No repairs found for {description}.")
+            return
+        response = (
+            f"🔧 Total Production Loss for {description}: {result['Total Production Loss']}%\n"
+            f"🔧 Total Repair Time for {description}: {result['Total Repair Time']} hours\n"
+            f"🔧 Repairs: {result['Repairs']}"
+        )
+        await replier.send(response)
+        return
+
+    if intent == "count":
+        subject = f"{parsed['machine_name']} machines" if parsed["machine_name"] else "machines"
+        machine_count = await asyncio.to_thread(query_repair_count, parsed)
+        if machine_count is None:
+            await replier.send("❌ No data found for the specified query.")
+            return
+        await replier.send(f"Total number of {describe_filters(parsed, subject)}: {machine_count}")
+        return
+
+    if intent == "root_cause":
+        issue_details = await asyncio.to_thread(query_issue_details, parsed)
+        if not issue_details:
+            await replier.send(f"❌ No records found for {description}.")
+            return
+        response = (
+            f"🔧 Issue: {issue_details['Issue']} ({describe_filters(dict(parsed, issue=None))})\n"
+            f"🔧 Occurrence Count: {issue_details['Occurrence Count']}\n"
+            f"🔧 Affected Machines: {', '.join(map(str, issue_details['Affected Machines']))}\n"
+            f"🔧 Root Cause(s): {', '.join(map(str, issue_details['Root Cause']))}\n"
+            f"🔧 Solution(s) Applied: {', '.join(map(str, issue_details['Solution Applied']))}"
+        )
+        await replier.send(response)
+        return
+
+    # Most repeated issue(s)
+    most_repeated_issues = await asyncio.to_thread(query_most_repeated_issues, parsed)
+    if not most_repeated_issues:
+        await replier.send(f"❌ No repeated issues found for {description}.")
+        return
+    response = f"🔧 Most Repeated Issue(s) for {description}:\n\n"
+    for issue in most_repeated_issues:
+        response += (
+            f"**Issue:** {issue['Issue']}\n"
+            f"**Occurrence Count:** {issue['Occurrence Count']}\n"
+            f"**Affected Machines:** {', '.join(map(str, issue['Affected Machines']))}\n"
+            f"**Root Cause(s):** {', '.join(map(str, issue['Root Cause']))}\n"
+            f"**Solution(s) Applied:** {', '.join(map(str, issue['Solution Applied']))}\n"
+            f"**Total Production Loss:** {issue['Total Production Loss']}%\n"
+            f"**Total Repair Time:** {issue['Total Repair Time']} hours\n\n"
+        )
+    await replier.send(response)
+
+# Batch API: answers as plain data (no chat formatting) for reports and bulk runs outside the chat UI.
+# Columns of every batch result row, in CSV order
+BATCH_RESULT_COLUMNS = ["Query", "Intent", "Machine ID", "Machine Name", "Technician Name", "Issue", "Date Range", "Result", "Error"]
+
+# Function to evaluate one parsed query against the current data; returns (result, error)
+def evaluate_intent(intent, parsed):
+    machine_id = parsed["machine_id"]
+    filtered = needs_sql_engine(intent, parsed) and (intent != "root_cause" or parsed["issue"])
+
+    if intent == "next_page":
+        return None, "Paging only applies to chat sessions"
+    if intent == "root_cause":
+        if not parsed["issue"]:
+            return None, "No issue description in the query"
+        result = query_issue_details(parsed) if filtered else get_issue_details(parsed["issue"])
+    elif intent == "production_loss":
+        if filtered:
+            result = query_totals(parsed)
         else:
-            response = f"No solution records found for {machine_id}."
-    elif "date" in user_query.lower():
-        # Get all repair dates for the Machine ID
-        dates = get_column_data(machine_id, "Date of Repair")
-        if dates:
-            response = f"Repair dates for {machine_id}:\n" + "\n".join(dates)
+            result = calculate_total_production_loss_and_repair_time(parsed["machine_name"], parsed["issue"], machine_id)
+    elif intent == "count":
+        count = query_repair_count(parsed) if filtered else count_machines_by_type(parsed["machine_name"])
+        result = {"Count": count} if count is not None else None
+    elif intent == "technician_repairs":
+        if not parsed["technician_name"]:
+            return None, "No technician name in the query"
+        result = get_machines_repaired_by_technician(parsed["technician_name"])
+    elif intent == "most_repeated":
+        if filtered:
+            result = query_most_repeated_issues(parsed)
         else:
-            response = f"No repair date records found for {machine_id}."
-    elif "time" in user_query.lower():
-        # Get all repair times for the Machine ID
-        times = get_column_data(machine_id, "Time Taken (in hours)")
-        if times:
-            response = f"Repair times for {machine_id}:\n" + "\n".join(times)
+            result = get_most_repeated_issue(machine_id, parsed["machine_name"], parsed["technician_name"])
+    elif intent == "repair_history":
+        if not machine_id:
+            return None, "No Machine ID in the query"
+        start, end, _ = parsed["date_range"] or (None, None, "")
+        result = get_machine_history(machine_id, start, end)
+    else:
+        if not machine_id:
+            return None, "No Machine ID in the query"
+        if parsed["column"]:
+            values = get_column_data(machine_id, parsed["column"])
+            result = {"Column": parsed["column"], "Values": values} if values else None
         else:
-            response = f"No repair time records found for {machine_id}."
-    elif "production loss" in user_query.lower():
-        # Get all production loss values for the Machine ID
-        losses = get_column_data(machine_id, "Production Loss (%)")
-        if losses:
-            response = f"Production losses for {machine_id}:\n" + "\n".join(losses)
+            result = get_latest_machine_info(machine_id)
+
+    if not result:
+        return None, "No matching records"
+    return result, None
+
+# Generator of one result row per query, in input order.
+# Queries are parsed up front; repeated questions (same intent and entities) are evaluated once,
+# and all similar-fixes queries share a single embedding and search batch.
+def iter_batch_results(queries, semantic_routing=True):
+    if not get_record_store():
+        raise RuntimeError("The maintenance data is not available")
+
+    parsed_queries = []
+    for query in queries:
+        parsed = parse_query(query)
+        intent = parsed["intent"]
+        if semantic_routing and intent == "machine_info" and not parsed["machine_id"]:
+            try:
+                intent = route_query_semantically(query)[0] or intent
+            except Exception as e:
+                # Without embeddings the rest of the batch uses keyword routing only
+                print(f"⚠️ Semantic routing unavailable: {e}")
+                semantic_routing = False
+        parsed_queries.append((query, intent, parsed))
+
+    similar_queries = list(dict.fromkeys(query for query, intent, _ in parsed_queries if intent == "similar_fixes"))
+    similar_results = {}
+    if similar_queries:
+        try:
+            similar_results = dict(zip(similar_queries, find_similar_repairs_batch(similar_queries)))
+        except Exception as e:
+            print(f"⚠️ Similarity search unavailable: {e}")
+
+    evaluated = {}
+    for query, intent, parsed in parsed_queries:
+        if intent == "similar_fixes":
+            result = similar_results.get(query)
+            answer = (result, None) if result else (None, "Similarity search found nothing" if query in similar_results else "Similarity search is not available")
         else:
-            response = f"No production loss records found for {machine_id}."
-    else:
-        # If no specific column is mentioned, return the latest record
-        response = (
-            f"**🔧 Latest Information for {machine_id}:**\n\n"
-            f"**Machine Name:** {latest_record.get('Machine Name', 'N/A')}\n"
-            f"**Issue Description:** {latest_record.get('Issue Description', 'N/A')}\n"
-            f"**Root Cause:** {latest_record.get('Root Cause', 'N/A')}\n"
-            f"**Solution Applied:** {latest_record.get('Solution Applied', 'N/A')}\n"
-            f"**Technician Name:** {latest_record.get('Technician Name', 'N/A')}\n"
-            f"**Date of Repair:** {latest_record.get('Date of Repair', 'N/A')}\n"
-            f"**Time Taken (in hours):** {latest_record.get('Time Taken (in hours)', 'N/A')}\n"
-            f"**Production Loss (%):** {latest_record.get('Production Loss (%)', 'N/A')}\n"
-            f"**Additional Notes:** {latest_record.get('Additional Notes', 'N/A')}"
-        )
+            key = response_cache_key(intent, parsed)
+            if key not in evaluated:
+                evaluated[key] = evaluate_intent(intent, parsed)
+            answer = evaluated[key]
+        result, error = answer
+        yield {
+            "Query": query,
+            "Intent": intent,
+            "Machine ID": parsed["machine_id"],
+            "Machine Name": parsed["machine_name"],
+            "Technician Name": parsed["technician_name"],
+            "Issue": parsed["issue"],
+            "Date Range": parsed["date_range"][2] if parsed["date_range"] else None,
+            "Result": result,
+            "Error": error or "",
+        }
 
-    # Send the response back to the Chainlit UI
-    await cl.Message(content=response).send()
+# Columns of every machine report row, in CSV order
+MACHINE_REPORT_COLUMNS = [
+    "Machine ID", "Machine Name", "Repairs", "Total Production Loss", "Total Repair Time", "Top Issues",
+    "Latest Repair Date", "Latest Issue", "Latest Root Cause", "Latest Solution", "Latest Technician", "Error",
+]
+
+# Generator of one report row per Machine ID (every machine when none are given): latest repair,
+# totals and top issues, read straight from the indexes and materialized views
+def iter_machine_reports(machine_ids=None, top_n=3):
+    store = get_record_store()
+    if not store:
+        raise RuntimeError("The maintenance data is not available")
+    if machine_ids is None:
+        machine_ids = [machine_id for machine_id in store.by_id if machine_id]
+    for machine_id in machine_ids:
+        machine_id = normalize_key(machine_id, upper=True)
+        view = store.view("by_id", machine_id)
+        if not view:
+            yield {"Machine ID": machine_id, "Error": "No records found"}
+            continue
+        latest = store.rows[store.latest_position(machine_id)]
+        yield {
+            "Machine ID": machine_id,
+            "Machine Name": latest.get("Machine Name", "N/A"),
+            "Repairs": view.count,
+            "Total Production Loss": view.production_loss,
+            "Total Repair Time": view.repair_time,
+            "Top Issues": [f"{issue} ({issue_view.count})" for issue, issue_view in view.top_issues(top_n)],
+            "Latest Repair Date": latest.get("Date of Repair", "N/A"),
+            "Latest Issue": latest.get("Issue Description", "N/A"),
+            "Latest Root Cause": latest.get("Root Cause", "N/A"),
+            "Latest Solution": latest.get("Solution Applied", "N/A"),
+            "Latest Technician": latest.get("Technician Name", "N/A"),
+            "Error": "",
+        }
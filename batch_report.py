@@ -0,0 +1,127 @@
+import csv
+import sys
+import json
+import argparse
+import contextlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import app
+
+# Function to flatten one value for a CSV cell: lists of labels are joined, anything nested becomes JSON
+def csv_cell(value):
+    if value is None:
+        return ""
+    if isinstance(value, list) and all(not isinstance(item, (dict, list)) for item in value):
+        return "; ".join(str(item) for item in value)
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, default=str)
+    return value
+
+# Writes result rows to a stream as they come, as CSV or JSON lines
+class RowWriter:
+    def __init__(self, stream, output_format, columns):
+        self.stream = stream
+        self.output_format = output_format
+        self.columns = columns
+        if output_format == "csv":
+            self.writer = csv.DictWriter(stream, fieldnames=columns, extrasaction="ignore")
+            self.writer.writeheader()
+
+    def write(self, row):
+        if self.output_format == "csv":
+            self.writer.writerow({column: csv_cell(row.get(column)) for column in self.columns})
+        else:
+            self.stream.write(json.dumps(row, default=str) + "\n")
+
+# Worker-process entry points: each evaluates one chunk against the data inherited from (or loaded in) the worker
+def evaluate_query_chunk(queries):
+    return list(app.iter_batch_results(queries))
+
+def evaluate_machine_chunk(arguments):
+    machine_ids, top_n = arguments
+    return list(app.iter_machine_reports(machine_ids, top_n))
+
+# Function to split items into consecutive chunks, so results come back in input order
+def chunked(items, chunk_size):
+    return [items[start:start + chunk_size] for start in range(0, len(items), chunk_size)]
+
+# Function to read non-empty, non-comment lines from a file ("-" for stdin)
+def read_lines(path):
+    stream = sys.stdin if path == "-" else open(path, encoding="utf-8")
+    try:
+        return [line.strip() for line in stream if line.strip() and not line.startswith("#")]
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Answer maintenance questions in bulk and stream the results as CSV or JSON lines.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--queries", help="File with one question per line (\"-\" for stdin)")
+    source.add_argument("--machines", help="Comma-separated Machine IDs to report on")
+    source.add_argument("--machines-file", help="File with one Machine ID per line")
+    source.add_argument("--all-machines", action="store_true", help="Report on every Machine ID in the sheet")
+    parser.add_argument("--format", choices=["csv", "jsonl"], default="csv", help="Output format")
+    parser.add_argument("--output", default="-", help="Output file (default: stdout)")
+    parser.add_argument("--top", type=int, default=3, help="Top issues per machine in machine reports")
+    parser.add_argument("--workers", type=int, default=1, help="Evaluate in this many processes")
+    parser.add_argument("--chunk-size", type=int, default=500, help="Queries or machines per worker task")
+    args = parser.parse_args()
+
+    # The app's progress messages go to stderr so stdout only carries the report
+    stdout = sys.stdout
+    with contextlib.redirect_stdout(sys.stderr):
+        return run(args, stdout)
+
+def run(args, stdout):
+    # Load the data once up front; forked workers share this copy instead of each fetching the sheet
+    if not app.get_record_store():
+        print("❌ The maintenance data is not available.", file=sys.stderr)
+        return 1
+    # A start from the local snapshot reconciles with the sheet in the background; report on the reconciled data
+    app.wait_for_background_refresh()
+
+    if args.queries:
+        items = read_lines(args.queries)
+        columns = app.BATCH_RESULT_COLUMNS
+        evaluate = evaluate_query_chunk
+        tasks = chunked(items, args.chunk_size)
+    else:
+        if args.machines:
+            items = [machine_id.strip() for machine_id in args.machines.split(",") if machine_id.strip()]
+        elif args.machines_file:
+            items = read_lines(args.machines_file)
+        else:
+            items = [machine_id for machine_id in app.get_record_store().by_id if machine_id]
+        columns = app.MACHINE_REPORT_COLUMNS
+        evaluate = evaluate_machine_chunk
+        tasks = [(chunk, args.top) for chunk in chunked(items, args.chunk_size)]
+
+    output = stdout if args.output == "-" else open(args.output, "w", encoding="utf-8", newline="")
+    writer = RowWriter(output, args.format, columns)
+    try:
+        if args.workers > 1:
+            # Forked workers inherit the loaded snapshot; elsewhere each worker loads its own
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context("fork" if "fork" in methods else None)
+            with ProcessPoolExecutor(max_workers=args.workers, mp_context=context) as pool:
+                for rows in pool.map(evaluate, tasks):
+                    for row in rows:
+                        writer.write(row)
+                    output.flush()
+        elif args.queries:
+            # In-process runs stream row by row and share the de-duplication across the whole file
+            for row in app.iter_batch_results(items):
+                writer.write(row)
+        else:
+            for row in app.iter_machine_reports(items, args.top):
+                writer.write(row)
+    finally:
+        if output is not stdout:
+            output.close()
+    print(f"✅ Wrote {len(items)} {'results' if args.queries else 'machine reports'}.", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,350 @@
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import hashlib
+import argparse
+import tempfile
+from datetime import date, timedelta
+from collections import defaultdict
+
+# Keep benchmark runs offline and away from the app's own caches: no background
+# sheet refreshes, embeddings and the vector index go to a scratch directory
+_scratch_dir = tempfile.mkdtemp(prefix="mechmate-bench-")
+os.environ.setdefault("SHEET_REFRESH_INTERVAL", "inf")
+os.environ.setdefault("EMBEDDING_CACHE_PATH", os.path.join(_scratch_dir, "embeddings.sqlite3"))
+os.environ.setdefault("REPAIR_INDEX_DIR", os.path.join(_scratch_dir, "repair_index"))
+
+import app
+
+DEFAULT_SIZES = [1000, 100000, 1000000]  # Sheet sizes (rows) to benchmark
+DEFAULT_BASELINE_PATH = "benchmark_baseline.json"  # Saved results that later runs are compared against
+DEFAULT_TOLERANCE = 0.25  # Allowed slowdown against the baseline before a metric is reported as a regression
+MIN_REGRESSION_MS = 0.25  # Ignore slowdowns smaller than this; sub-millisecond percentiles jitter from run to run
+
+# Machine types and the issues each one typically has: (issue, root causes, solutions)
+MACHINE_TYPES = {
+    "CNC Machine": [
+        ("Spindle Overheating", ["Insufficient lubrication", "Clogged coolant line"], ["Cleaned coolant line", "Refilled spindle oil"]),
+        ("Tool Breakage", ["Worn tool holder", "Incorrect feed rate"], ["Replaced tool holder", "Adjusted feed rate"]),
+        ("Axis Misalignment", ["Loose ball screw", "Encoder fault"], ["Tightened ball screw", "Replaced encoder"]),
+    ],
+    "Lathe Machine": [
+        ("Excessive Vibration", ["Worn bearings", "Unbalanced chuck"], ["Replaced bearings", "Balanced chuck"]),
+        ("Chatter Marks", ["Loose tool post", "Worn bearings"], ["Tightened tool post", "Replaced bearings"]),
+        ("Belt Slippage", ["Stretched belt"], ["Replaced drive belt", "Adjusted belt tension"]),
+    ],
+    "Milling Machine": [
+        ("Bearing Failure", ["Lack of lubrication", "Contamination"], ["Replaced bearings", "Installed new seals"]),
+        ("Table Not Moving", ["Broken feed gear", "Motor fault"], ["Replaced feed gear", "Rewound motor"]),
+        ("Spindle Overheating", ["Insufficient lubrication"], ["Refilled spindle oil"]),
+    ],
+    "Grinding Machine": [
+        ("Wheel Imbalance", ["Improper wheel mounting"], ["Remounted and balanced wheel"]),
+        ("Poor Surface Finish", ["Dull grinding wheel", "Coolant contamination"], ["Dressed grinding wheel", "Replaced coolant"]),
+    ],
+    "Drilling Machine": [
+        ("Unexpected Shutdown", ["Overload relay tripped", "Loose wiring"], ["Reset overload relay", "Rewired control panel"]),
+        ("Drill Bit Wobble", ["Worn chuck jaws"], ["Replaced chuck"]),
+    ],
+    "Hydraulic Press": [
+        ("Oil Leakage", ["Damaged seal", "Cracked hose"], ["Replaced seal", "Replaced hydraulic hose"]),
+        ("Pressure Drop", ["Faulty relief valve", "Air in hydraulic lines"], ["Replaced relief valve", "Bled hydraulic lines"]),
+    ],
+}
+TECHNICIANS = ["Rajesh", "Suresh", "Vikram", "Gopal", "Sanjay", "Manoj", "Anil", "Karthik", "Priya", "Deepa"]
+NOTES = ["", "", "", "Monitor for recurrence", "Spare part ordered", "Operator trained", "Follow-up next week"]
+FIRST_REPAIR_DATE = date(2022, 1, 1)
+REPAIR_DAYS = 3 * 365
+
+# Function to generate a synthetic maintenance sheet with the same columns and cell formats as the real one
+def generate_sheet(rows, seed=42):
+    rng = random.Random(seed)
+    # Machine IDs follow the MM### pattern, so there are at most 999 machines
+    machine_count = min(999, max(10, rows // 25))
+    machines = [(f"MM{number:03d}", rng.choice(list(MACHINE_TYPES))) for number in range(1, machine_count + 1)]
+    records = []
+    for _ in range(rows):
+        machine_id, machine_name = rng.choice(machines)
+        issue, root_causes, solutions = rng.choice(MACHINE_TYPES[machine_name])
+        repaired = FIRST_REPAIR_DATE + timedelta(days=rng.randrange(REPAIR_DAYS))
+        loss = round(rng.uniform(0.5, 20), 1)
+        records.append({
+            "ID": machine_id,
+            "Machine Name": machine_name,
+            "Issue Description": issue,
+            "Root Cause": rng.choice(root_causes),
+            "Solution Applied": rng.choice(solutions),
+            "Technician Name": rng.choice(TECHNICIANS),
+            "Date of Repair": repaired.strftime("%m/%d/%Y"),
+            # Mostly numbers, like a hand-maintained sheet: some percentages are typed with a "%", a few cells are blank
+            "Time Taken (in hours)": "" if rng.random() < 0.01 else rng.choice([0.5, 1, 1.5, 2, 3, 4, 6, 8]),
+            "Production Loss (%)": "" if rng.random() < 0.01 else rng.choice([loss, f"{loss}%"]),
+            "Additional Notes": rng.choice(NOTES),
+        })
+    return records
+
+# Query templates for the mixed workload, weighted roughly like real chat traffic
+QUERY_TEMPLATES = [
+    (20, "{machine_id}"),
+    (6, "who repaired {machine_id}"),
+    (6, "what is the root cause of {machine_id}"),
+    (4, "production loss of {machine_id}"),
+    (8, "what is the root cause of {issue}"),
+    (6, "total production loss for {machine_name}"),
+    (3, "total production loss"),
+    (6, "how many {machine_name}s are there"),
+    (2, "how many machines are there"),
+    (8, "machines repaired by {technician}"),
+    (5, "most repeated issue for {machine_id}"),
+    (4, "most repeated issue in {machine_name}"),
+    (2, "most repeated issue"),
+    (6, "repair history of {machine_id} in {year}"),
+    (4, "repair history of {machine_id} since {month} {year}"),
+    (4, "show next"),
+    (3, "which machines had trouble last winter"),
+    (3, "what fixed {issue} before"),
+    (3, "production loss for {machine_name}s repaired by {technician} in {year}"),
+    (2, "most repeated issue in {machine_name} since {month} {year}"),
+]
+MONTH_NAMES = ["january", "march", "june", "september", "november"]
+
+# Function to build a seeded, replayable list of queries over the generated sheet's vocabulary
+def generate_workload(records, count, seed=7):
+    rng = random.Random(seed)
+    machine_ids = sorted({row["ID"] for row in records})
+    issues = sorted({row["Issue Description"] for row in records})
+    weights = [weight for weight, _ in QUERY_TEMPLATES]
+    templates = [template for _, template in QUERY_TEMPLATES]
+    queries = []
+    for template in rng.choices(templates, weights=weights, k=count):
+        queries.append(template.format(
+            machine_id=rng.choice(machine_ids),
+            machine_name=rng.choice(list(MACHINE_TYPES)).lower(),
+            technician=rng.choice(TECHNICIANS).lower(),
+            issue=rng.choice(issues).lower(),
+            month=rng.choice(MONTH_NAMES),
+            year=rng.choice([2022, 2023, 2024]),
+        ))
+    return queries
+
+# Deterministic bag-of-words embedding so semantic routing and similarity search run offline
+def local_embedding(texts, input_type):
+    vectors = []
+    for text in texts:
+        vector = [0.0] * 256
+        for word in text.lower().replace("|", " ").replace(",", " ").replace("?", " ").split():
+            vector[int(hashlib.md5(word.encode()).hexdigest(), 16) % 256] += 1.0
+        vectors.append(vector)
+    return vectors
+
+# Function to summarize a list of latencies (seconds) into throughput and percentiles (milliseconds)
+def summarize(latencies):
+    ordered = sorted(latencies)
+    total = sum(ordered)
+
+    def percentile(p):
+        return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))] * 1000
+
+    return {
+        "Calls": len(ordered),
+        "Ops/s": round(len(ordered) / total, 1) if total else None,
+        "p50 ms": round(percentile(50), 4),
+        "p95 ms": round(percentile(95), 4),
+        "p99 ms": round(percentile(99), 4),
+        "Max ms": round(ordered[-1] * 1000, 4),
+    }
+
+# Function to time one helper over a list of argument tuples
+def time_calls(function, arguments):
+    latencies = []
+    for args in arguments:
+        started = time.perf_counter()
+        function(*args)
+        latencies.append(time.perf_counter() - started)
+    return summarize(latencies)
+
+# Function to benchmark the cold load: numeric parsing, indexes, timelines and aggregate views, then the SQL tables
+def benchmark_load(records):
+    worksheet = app.MemoryWorksheet.from_records(records)
+    app.set_data_source(worksheet)
+    started = time.perf_counter()
+    store = app.get_record_store()
+    elapsed = time.perf_counter() - started
+    # The SQL engine for multi-filter questions is built on first use after each load
+    started = time.perf_counter()
+    app.get_sql_engine()
+    sql_elapsed = time.perf_counter() - started
+    return store, {"Seconds": round(elapsed, 3), "Rows/s": round(len(store.rows) / elapsed), "SQL engine seconds": round(sql_elapsed, 3)}
+
+# Function to benchmark every query helper with seeded arguments drawn from the loaded data
+def benchmark_helpers(store, calls, seed=11):
+    rng = random.Random(seed)
+    machine_ids = list(store.by_id)
+    machine_names = list(store.by_machine_name)
+    technicians = list(store.by_technician)
+    issues = list(store.by_issue)
+    columns = ["Technician Name", "Root Cause", "Production Loss (%)", "Date of Repair"]
+
+    def pick(values):
+        return [rng.choice(values) for _ in range(calls)]
+
+    def spread_years():
+        year = rng.choice([2022, 2023, 2024])
+        return date(year, 1, 1).toordinal(), date(year, 12, 31).toordinal()
+
+    # Listing helpers are measured with their first page rendered, as a chat reply would be
+    def first_page(listing):
+        return "".join(listing.render_page(0)) if listing else None
+
+    benchmarks = {
+        "get_latest_machine_info": (app.get_latest_machine_info, [(value,) for value in pick(machine_ids)]),
+        "get_column_data": (app.get_column_data, [(value, rng.choice(columns)) for value in pick(machine_ids)]),
+        "get_machine_history": (app.get_machine_history, [(value, *spread_years()) for value in pick(machine_ids)]),
+        "get_most_repeated_issue (all)": (app.get_most_repeated_issue, [() for _ in range(calls)]),
+        "get_most_repeated_issue (machine)": (app.get_most_repeated_issue, [(None, value) for value in pick(machine_names)]),
+        "get_top_issues": (app.get_top_issues, [(value, None, None, 5) for value in pick(machine_names)]),
+        "count_machines_by_type": (app.count_machines_by_type, [(value,) for value in pick(machine_names)]),
+        "get_machines_repaired_by_technician": (app.get_machines_repaired_by_technician, [(value,) for value in pick(technicians)]),
+        "calculate_total_production_loss_and_repair_time": (app.calculate_total_production_loss_and_repair_time, [(value,) for value in pick(machine_names)]),
+        "get_issue_details": (app.get_issue_details, [(value,) for value in pick(issues)]),
+        "get_technician_listing (page 1)": (lambda name: first_page(app.get_technician_listing(name)), [(value,) for value in pick(technicians)]),
+        "get_history_listing (page 1)": (lambda machine_id: first_page(app.get_history_listing(machine_id)), [(value,) for value in pick(machine_ids)]),
+        "query_totals (3 filters)": (app.query_totals, [(app.parse_query(f"production loss for {value} repaired by {rng.choice(technicians)} in {rng.choice([2022, 2023, 2024])}"),) for value in pick(machine_names)]),
+        "query_most_repeated_issues (2 filters)": (app.query_most_repeated_issues, [(app.parse_query(f"most repeated issue in {value} since march {rng.choice([2022, 2023, 2024])}"),) for value in pick(machine_names)]),
+        "parse_query": (app.parse_query, [(f"most repeated issue for {value} repaired by vikram since march 2023",) for value in pick(machine_ids)]),
+    }
+
+    results = {}
+    for name, (function, arguments) in benchmarks.items():
+        # Each call builds a summary for every repair of one technician (about a tenth of the sheet),
+        # so it is far slower per call than the other lookups; cap its calls so large sheets finish
+        if name == "get_machines_repaired_by_technician":
+            arguments = arguments[:max(1, calls // 20)]
+        results[name] = time_calls(function, arguments)
+    return results
+
+# Function to replay the workload through the full chat routing (handle_query), one session in order.
+# A first unmeasured pass warms the embedding cache and the vector index, so the numbers are steady-state.
+# With the response cache off every query is computed; with it on, repeated questions are cache hits.
+async def benchmark_routing(queries, response_cache=False):
+    app.response_cache.clear()
+    app.response_cache.max_entries = app.RESPONSE_CACHE_SIZE if response_cache else 0
+    session = app.LocalSession()
+    for query in queries:
+        await app.answer_query(query, session)
+    session = app.LocalSession()
+    latencies = []
+    by_intent = defaultdict(list)
+    for query in queries:
+        started = time.perf_counter()
+        _, trace = await app.answer_query(query, session)
+        elapsed = time.perf_counter() - started
+        latencies.append(elapsed)
+        by_intent[trace.intent].append(elapsed)
+    results = {"all": summarize(latencies)}
+    for intent, values in sorted(by_intent.items()):
+        results[intent] = summarize(values)
+    return results
+
+# Function to compare a run against the baseline; returns the list of regressions
+def compare_with_baseline(results, baseline, tolerance):
+    regressions = []
+    for size, sections in results.items():
+        for section in ("Helpers", "Routing", "Cached routing"):
+            for name, current in sections.get(section, {}).items():
+                previous = baseline.get(size, {}).get(section, {}).get(name)
+                if not previous:
+                    continue
+                for metric in ("p50 ms", "p95 ms"):
+                    before, after = previous[metric], current[metric]
+                    if after - before > MIN_REGRESSION_MS and after > before * (1 + tolerance):
+                        regressions.append(f"{size} rows / {section} / {name}: {metric} {before:.3f} -> {after:.3f}")
+        previous_load = baseline.get(size, {}).get("Load")
+        if previous_load and sections["Load"]["Seconds"] > previous_load["Seconds"] * (1 + tolerance):
+            regressions.append(f"{size} rows / Load: {previous_load['Seconds']:.3f} s -> {sections['Load']['Seconds']:.3f} s")
+    return regressions
+
+# Function to print one results table
+def print_table(title, rows):
+    print(f"\n{title}")
+    print(f"  {'':<50} {'Calls':>7} {'Ops/s':>11} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10}")
+    for name, stats in rows.items():
+        print(f"  {name:<50} {stats['Calls']:>7} {stats['Ops/s'] or 0:>11} {stats['p50 ms']:>10.3f} {stats['p95 ms']:>10.3f} {stats['p99 ms']:>10.3f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark of the maintenance chatbot's query helpers and routing.")
+    parser.add_argument("--sizes", default=",".join(str(size) for size in DEFAULT_SIZES), help="Comma-separated sheet sizes in rows")
+    parser.add_argument("--calls", type=int, default=200, help="Calls per helper benchmark")
+    parser.add_argument("--queries", type=int, default=500, help="Queries in the generated routing workload")
+    parser.add_argument("--seed", type=int, default=42, help="Seed for the sheet and workload generators")
+    parser.add_argument("--workload", help="Replay queries from this file (one per line) instead of generating them")
+    parser.add_argument("--save-workload", help="Write the generated workload to this file for later replays")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE_PATH, help="Baseline results file")
+    parser.add_argument("--save-baseline", action="store_true", help="Save this run as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="Allowed slowdown ratio before failing")
+    parser.add_argument("--output", help="Also write this run's results to a JSON file")
+    args = parser.parse_args()
+
+    app.set_embedding_function(local_embedding, "benchmark-local")
+    results = {}
+    for size in [int(value) for value in args.sizes.split(",") if value.strip()]:
+        print(f"📊 Generating {size} rows...")
+        records = generate_sheet(size, args.seed)
+        store, load = benchmark_load(records)
+        print(f"📥 Loaded {size} rows in {load['Seconds']} s (SQL engine built in {load['SQL engine seconds']} s)")
+
+        if args.workload:
+            with open(args.workload, encoding="utf-8") as f:
+                queries = [line.strip() for line in f if line.strip()]
+        else:
+            queries = generate_workload(records, args.queries, args.seed)
+            if args.save_workload:
+                with open(args.save_workload, "w", encoding="utf-8") as f:
+                    f.write("\n".join(queries) + "\n")
+
+        helpers = benchmark_helpers(store, args.calls)
+        # Handlers print a line per query; keep the benchmark output readable
+        with open(os.devnull, "w") as devnull:
+            stdout, sys.stdout = sys.stdout, devnull
+            try:
+                routing = asyncio.run(benchmark_routing(queries))
+                cached_routing = asyncio.run(benchmark_routing(queries, response_cache=True))
+            finally:
+                sys.stdout = stdout
+
+        results[str(size)] = {"Load": load, "Helpers": helpers, "Routing": routing, "Cached routing": cached_routing}
+        print_table(f"🔧 Helpers ({size} rows)", helpers)
+        print_table(f"🧭 Routing ({size} rows, {len(queries)} queries)", routing)
+        print_table(f"⚡ Routing with the response cache ({size} rows, {len(queries)} queries)", cached_routing)
+        del records, store
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"\n💾 Baseline saved to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"\nℹ️ No baseline at {args.baseline}; run with --save-baseline to create one.")
+        return 0
+
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    regressions = compare_with_baseline(results, baseline, args.tolerance)
+    if regressions:
+        print(f"\n❌ {len(regressions)} regression(s) against {args.baseline}:")
+        for regression in regressions:
+            print(f"  {regression}")
+        return 1
+    print(f"\n✅ No regressions against {args.baseline}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
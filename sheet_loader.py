@@ -0,0 +1,50 @@
+import os
+import sys
+import time
+import argparse
+
+import app
+
+DEFAULT_SHARED_SNAPSHOT_DIR = ".shared_snapshots"  # Used when SHARED_SNAPSHOT_DIR isn't set
+
+# Function to fetch the sheet once and publish a new snapshot if anything changed; returns (store, version)
+def publish_if_changed(directory, store, version):
+    new_store = app.fetch_record_store(store)
+    # A full reload always builds a new store, so compare the rows before publishing an identical snapshot
+    if store is not None and (new_store is store or (new_store.header == store.header and new_store.rows == store.rows)):
+        return store, version
+    version += 1
+    manifest = app.publish_snapshot(new_store, directory, version)
+    print(f"📤 Published snapshot {version} with {manifest['rows']} rows to {directory}")
+    return new_store, version
+
+def main():
+    parser = argparse.ArgumentParser(description="Fetch the maintenance sheet and publish snapshots for the chat workers.")
+    parser.add_argument("--dir", default=app.SHARED_SNAPSHOT_DIR or DEFAULT_SHARED_SNAPSHOT_DIR, help="Directory the workers read snapshots from (their SHARED_SNAPSHOT_DIR)")
+    parser.add_argument("--interval", type=float, default=app.SHEET_REFRESH_INTERVAL, help="Seconds between sheet fetches")
+    parser.add_argument("--once", action="store_true", help="Publish once and exit (e.g. from cron)")
+    args = parser.parse_args()
+
+    # Resume from the last published snapshot so incremental sync only fetches the tail of the sheet
+    manifest = app.read_manifest(args.dir)
+    version = manifest["version"] if manifest else 0
+    store = app.load_snapshot(os.path.join(args.dir, manifest["file"])) if manifest else None
+    if store is not None:
+        # Published snapshots load read-only with their columns mapped; sync into a writable copy
+        store = store.copy()
+    print(f"🚚 Sheet loader publishing to {args.dir} (start workers with SHARED_SNAPSHOT_DIR={os.path.abspath(args.dir)})")
+
+    while True:
+        try:
+            store, version = publish_if_changed(args.dir, store, version)
+        except Exception as e:
+            # Workers keep serving the last published snapshot; try again on the next round
+            print(f"⚠️ Could not fetch and publish the sheet: {e}")
+            if args.once:
+                return 1
+        if args.once:
+            return 0
+        time.sleep(args.interval)
+
+if __name__ == "__main__":
+    sys.exit(main())
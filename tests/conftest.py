@@ -0,0 +1,13 @@
+import os
+import sys
+import tempfile
+
+# Keep test runs offline and away from the app's on-disk caches
+_scratch_dir = tempfile.mkdtemp(prefix="mechmate-tests-")
+os.environ["SNAPSHOT_PATH"] = ""
+os.environ["SHEET_REFRESH_INTERVAL"] = "inf"
+os.environ["EMBEDDING_CACHE_PATH"] = os.path.join(_scratch_dir, "embeddings.sqlite3")
+os.environ["REPAIR_INDEX_DIR"] = os.path.join(_scratch_dir, "repair_index")
+os.environ.pop("SHARED_SNAPSHOT_DIR", None)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
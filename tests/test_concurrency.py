@@ -0,0 +1,50 @@
+import time
+import asyncio
+import threading
+
+import app
+from test_sync import HEADER, make_worksheet
+
+# A sheet that takes a while to answer, like the Google Sheets API on a cold start
+class SlowWorksheet(app.MemoryWorksheet):
+    def __init__(self, header, values, delay):
+        super().__init__(header, values)
+        self.delay = delay
+        self.fetches = 0
+        self.lock = threading.Lock()
+
+    def get_all_records(self):
+        with self.lock:
+            self.fetches += 1
+        time.sleep(self.delay)
+        return super().get_all_records()
+
+def test_concurrent_sessions_share_one_cold_load_without_blocking_the_loop():
+    worksheet = SlowWorksheet(HEADER, make_worksheet(200).values, delay=0.5)
+    app.set_data_source(worksheet)
+
+    async def run():
+        ticks = 0
+        done = asyncio.Event()
+
+        async def ticker():
+            nonlocal ticks
+            while not done.is_set():
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        ticking = asyncio.ensure_future(ticker())
+        results = await asyncio.gather(*(
+            app.answer_query(f"total production loss for MM{number % 40 + 1:03d}", app.LocalSession())
+            for number in range(50)
+        ))
+        done.set()
+        await ticking
+        return results, ticks
+
+    results, ticks = asyncio.run(run())
+
+    assert worksheet.fetches == 1
+    # The loop kept running while the sheet was being fetched in a worker thread
+    assert ticks >= 20
+    assert all("Total Production Loss" in messages[0] for messages, _ in results)
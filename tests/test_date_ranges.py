@@ -0,0 +1,50 @@
+from datetime import date
+
+import pytest
+
+import app
+
+TODAY = date(2024, 5, 15)
+
+def bounds(query):
+    start, end, label = app.extract_date_range(query, TODAY)
+    return (
+        date.fromordinal(start) if start is not None else None,
+        date.fromordinal(end) if end is not None else None,
+        label,
+    )
+
+@pytest.mark.parametrize("query, expected", [
+    # A month without a year is its most recent occurrence, counting the current month
+    ("history of MM001 since march", (date(2024, 3, 1), None)),
+    ("history of MM001 since may", (date(2024, 5, 1), None)),
+    ("history of MM001 since june", (date(2023, 6, 1), None)),
+    ("repairs until dec", (None, date(2023, 12, 31))),
+    ("repairs in sept 2023", (date(2023, 9, 1), date(2023, 9, 30))),
+    ("repairs in 2023", (date(2023, 1, 1), date(2023, 12, 31))),
+    ("repairs before 2024-05-01", (None, date(2024, 4, 30))),
+    ("repairs after 3/15/2024", (date(2024, 3, 16), None)),
+    ("repairs from 3/1/2024 to 4/1/2024", (date(2024, 3, 1), date(2024, 4, 1))),
+    # The start of a range takes its year from the end of the range
+    ("repairs between jan and mar 2024", (date(2024, 1, 1), date(2024, 3, 31))),
+    ("repairs between jan and mar 2023", (date(2023, 1, 1), date(2023, 3, 31))),
+    ("repairs between nov and feb 2024", (date(2023, 11, 1), date(2024, 2, 29))),
+    ("repairs since march until april", (date(2024, 3, 1), date(2024, 4, 30))),
+])
+def test_date_ranges(query, expected):
+    assert bounds(query)[:2] == expected
+
+def test_the_label_is_the_matched_text():
+    assert bounds("history since march until april")[2] == "since march until april"
+
+@pytest.mark.parametrize("query", [
+    "history of MM001",
+    "repairs after 13/45/2024",
+    "repairs since 2/30/2024",
+    "repairs before 2024-02-30",
+])
+def test_invalid_or_missing_dates_give_no_range(query):
+    assert app.extract_date_range(query, TODAY) is None
+
+def test_an_invalid_bound_is_skipped_and_the_valid_one_kept():
+    assert bounds("repairs since 2/30/2024 until april")[:2] == (None, date(2024, 4, 30))
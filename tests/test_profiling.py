@@ -0,0 +1,13 @@
+import app
+
+def test_only_one_message_is_profiled_at_a_time():
+    first = app.start_profiler()
+    assert first is not None
+    try:
+        assert app.start_profiler() is None
+    finally:
+        app.stop_profiler(first)
+
+    second = app.start_profiler()
+    assert second is not None
+    app.stop_profiler(second)
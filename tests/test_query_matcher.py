@@ -0,0 +1,29 @@
+import time
+
+import app
+from test_sync import make_worksheet
+
+def test_a_term_carries_the_meaning_of_the_terms_it_starts_with():
+    matcher = app.QueryMatcher(issues=["belt", "belt slip", "belt slipping"])
+    assert matcher.meanings["belt slipping"] == [("issue", "belt slipping"), ("issue", "belt slip"), ("issue", "belt")]
+    assert matcher.parse("how often does belt slipping happen")["issue"] == "belt slipping"
+
+def test_matcher_build_scales_with_many_issues():
+    issues = [f"issue {number} on line {number % 17}" for number in range(6000)]
+    started = time.perf_counter()
+    matcher = app.QueryMatcher(issues=issues)
+    assert time.perf_counter() - started < 2
+    assert matcher.parse("details about issue 4321 on line 3")["issue"] == "issue 4321 on line 3"
+
+def test_refresh_prepares_the_matcher_before_the_chat_path_needs_it(monkeypatch):
+    app.set_data_source(make_worksheet(50))
+    store = app.refresh_record_store()
+    built = []
+    monkeypatch.setattr(app, "QueryMatcher", lambda *args: built.append(args))
+
+    app.parse_query("show the bearing failure history for MM001")
+    # A reload of an unchanged sheet reuses the matcher for the same vocabulary
+    assert app.refresh_record_store() is not store
+    app.parse_query("show the bearing failure history for MM001")
+
+    assert built == []
@@ -0,0 +1,35 @@
+import app
+from test_sync import HEADER, make_worksheet
+
+def make_store(values):
+    return app.RecordStore(app.records_from_values(HEADER, values))
+
+def test_totals_report_cells_that_could_not_be_parsed():
+    values = make_worksheet(80).values
+    values[0][8] = "n/a"
+    values[40][7] = "two"
+    store = make_store(values)
+
+    totals = store.view("by_id", "MM001")
+    assert (totals.count, totals.production_loss, totals.repair_time, totals.excluded_cells) == (2, 5.0, 2.0, 2)
+    assert store.view().excluded_cells == 2
+
+    # Fixing the cell in the sheet takes it out of the count again
+    fixed = dict(store.rows[0], **{"Production Loss (%)": "5%"})
+    store.replace_rows({0: fixed})
+    assert store.view("by_id", "MM001").excluded_cells == 1
+    assert store.view("by_issue", "Bearing Failure").excluded_cells == 1
+    assert store.copy().view().excluded_cells == 1
+
+def test_replacing_rows_drops_values_no_row_has_anymore():
+    values = make_worksheet(40).values
+    for number, row in enumerate(values):
+        row[3] = f"Cause {number}"
+    store = make_store(values)
+
+    store.replace_rows({position: dict(store.rows[position], **{"Root Cause": "Wear"}) for position in range(10)})
+    root_causes = store.view().root_causes
+    assert root_causes["Wear"] == 10
+    assert "Cause 0" not in root_causes and "Cause 10" in root_causes
+    assert len(root_causes) == 31
+    assert all(count > 0 for count in store.view("by_id", "MM001").root_causes.values())
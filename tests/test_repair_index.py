@@ -0,0 +1,114 @@
+import os
+import hashlib
+import multiprocessing
+
+import numpy as np
+
+import app
+from test_sync import make_worksheet
+
+# Deterministic stand-in for the embedding API with a configurable vector size
+def local_embedding(dimension):
+    def embed(texts, input_type):
+        return [
+            np.frombuffer(hashlib.sha256(text.encode("utf-8")).digest() * (dimension // 32 + 1), dtype=np.uint8)[:dimension].astype(float)
+            for text in texts
+        ]
+    return embed
+
+def use_sheet(worksheet):
+    app.set_data_source(worksheet)
+    return app.refresh_record_store()
+
+def test_changing_the_embedding_function_rebuilds_the_index(monkeypatch, tmp_path):
+    monkeypatch.setattr(app, "_embedding_function", app._embedding_function)
+    monkeypatch.setattr(app, "_embedding_function_name", app._embedding_function_name)
+    worksheet = make_worksheet(20)
+    for number, row in enumerate(worksheet.values):
+        row[3] = f"Cause {number % 5}"
+    store = use_sheet(worksheet)
+    index = app.RepairVectorIndex(str(tmp_path))
+
+    app.set_embedding_function(local_embedding(256), "local-256")
+    index.update(store)
+    assert index.matrix.shape == (5, 256)
+
+    app.set_embedding_function(local_embedding(3), "local-3")
+    index.update(store)
+    assert index.matrix.shape == (5, 3)
+    assert os.path.getsize(tmp_path / "vectors.f32") == 5 * 3 * 4
+    [matches] = index.search(local_embedding(3)(["Cause 1"], "search_query"))
+    assert len(matches) == 5
+
+    # A fresh process with the same function picks the rebuilt index up from disk
+    assert app.RepairVectorIndex(str(tmp_path)).keys == index.keys
+
+def test_vectors_no_longer_in_the_sheet_are_compacted_away(monkeypatch, tmp_path):
+    monkeypatch.setattr(app, "_embedding_function", app._embedding_function)
+    monkeypatch.setattr(app, "_embedding_function_name", app._embedding_function_name)
+    app.set_embedding_function(local_embedding(8), "local-8")
+    worksheet = make_worksheet(10)
+    for number, row in enumerate(worksheet.values):
+        row[3] = f"Cause {number}"
+    index = app.RepairVectorIndex(str(tmp_path))
+    index.update(use_sheet(worksheet))
+    assert len(index.keys) == 10
+
+    # Four stale vectors stay masked, then the file is compacted once most of it is stale
+    for row in worksheet.values[:4]:
+        row[3] = "Wear"
+    index.update(use_sheet(worksheet))
+    assert len(index.keys) == 11
+    for row in worksheet.values:
+        row[3] = "Wear"
+    index.update(use_sheet(worksheet))
+    assert len(index.keys) == 1
+    assert os.path.getsize(tmp_path / "vectors.f32") == 8 * 4
+    [matches] = index.search(local_embedding(8)(["Wear"], "search_query"))
+    assert [len(positions) for _, positions in matches] == [10]
+
+# Workers serve the same sheet, each seeing a few rows the others haven't synced yet
+def worker_causes(worker):
+    return [f"Cause {number}" for number in range(30)] + [f"Cause {worker}-{number}" for number in range(3)]
+
+def worker_store(worker):
+    worksheet = make_worksheet(33)
+    for row, cause in zip(worksheet.values, worker_causes(worker)):
+        row[3] = cause
+    return use_sheet(worksheet)
+
+def update_in_worker(directory, worker):
+    app.set_embedding_function(local_embedding(8), "local-8")
+    app.RepairVectorIndex(directory).update(worker_store(worker), batch_size=3)
+
+def test_workers_sharing_the_directory_keep_keys_and_vectors_aligned(monkeypatch, tmp_path):
+    monkeypatch.setattr(app, "_embedding_function", app._embedding_function)
+    monkeypatch.setattr(app, "_embedding_function_name", app._embedding_function_name)
+    context = multiprocessing.get_context("fork")
+    workers = [context.Process(target=update_in_worker, args=(str(tmp_path), worker)) for worker in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert all(worker.exitcode == 0 for worker in workers)
+
+    app.set_embedding_function(local_embedding(8), "local-8")
+    texts = {}
+    for worker in range(4):
+        for row in worker_store(worker).rows:
+            text = app.repair_text(row)
+            texts[hashlib.sha256(text.encode("utf-8")).hexdigest()] = text
+    index = app.RepairVectorIndex(str(tmp_path))
+    assert sorted(index.keys) == sorted(texts)
+    # Row i of the shared file is the vector of keys[i]
+    expected = np.asarray(local_embedding(8)([texts[key] for key in index.keys], "search_document"), dtype=np.float32)
+    expected /= np.linalg.norm(expected, axis=1, keepdims=True)
+    assert np.allclose(index.matrix, expected)
+
+    # The other workers' vectors are reused, not embedded again
+    monkeypatch.setattr(app, "_embedding_function", None)
+    store = worker_store(2)
+    index.update(store)
+    [matches] = index.search(local_embedding(8)([app.repair_text(store.rows[7])], "search_query"))
+    assert matches[0][1] == [7]
+    assert matches[0][0] > 0.999
@@ -0,0 +1,60 @@
+import asyncio
+
+import pytest
+
+import app
+from test_sync import make_worksheet
+
+@pytest.fixture
+def worksheet(monkeypatch):
+    monkeypatch.setattr(app, "response_cache", app.ResponseCache(16))
+    worksheet = make_worksheet(120)
+    app.set_data_source(worksheet)
+    return worksheet
+
+def answer(query, session=None):
+    messages, trace = asyncio.run(app.answer_query(query, app.LocalSession() if session is None else session))
+    return messages, trace.labels.get("response_cache")
+
+def test_cache_drops_entries_and_puts_from_other_versions():
+    cache = app.ResponseCache(4)
+    cache.put(1, "key", ["answer"])
+    assert cache.get(1, "key") == ["answer"]
+    # A newer version empties the cache, and answers computed on the old one aren't stored
+    assert cache.get(2, "key") is None
+    cache.put(1, "key", ["stale answer"])
+    assert cache.get(2, "key") is None
+    assert (cache.hits, cache.misses) == (1, 2)
+
+def test_repeated_question_is_answered_from_the_cache(worksheet):
+    first, result = answer("total production loss for MM001")
+    assert result == "miss"
+    second, result = answer("what is the total production loss for mm001")
+    assert result == "hit"
+    assert second == first
+
+def test_refresh_with_new_data_invalidates_cached_answers(worksheet):
+    before, _ = answer("total production loss for MM001")
+    worksheet.values[0][8] = "50%"
+    app.refresh_record_store()
+
+    after, result = answer("total production loss for MM001")
+    assert result == "miss"
+    assert before[0].startswith("🔧 Total Production Loss for MM001: 15.0%")
+    assert after[0].startswith("🔧 Total Production Loss for MM001: 60.0%")
+
+def test_replayed_listing_page_restores_the_show_next_cursor(worksheet, monkeypatch):
+    monkeypatch.setattr(app, "RESULTS_PAGE_SIZE", 50)
+    first_session = app.LocalSession()
+    first, result = answer("machines repaired by vikram", first_session)
+    assert result == "miss"
+
+    second_session = app.LocalSession()
+    second, result = answer("machines repaired by vikram", second_session)
+    assert result == "hit"
+    assert second == first
+    assert second_session["listing_cursor"][1] == 50
+
+    next_page, _ = answer("show next", second_session)
+    assert next_page == answer("show next", first_session)[0]
+    assert "Showing 51-100 of 120" in next_page[-1]
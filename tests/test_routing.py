@@ -0,0 +1,35 @@
+import asyncio
+
+import app
+from test_sync import make_worksheet
+
+def use_sheet_with_priya():
+    worksheet = make_worksheet(50)
+    for row in worksheet.values[:3]:
+        row[5] = "Priya"
+    for row in worksheet.values[1:3]:
+        row[2] = "Spindle Overheating"
+    app.set_data_source(worksheet)
+    app.get_record_store()
+
+def answer(query):
+    messages, trace = asyncio.run(app.answer_query(query, app.LocalSession()))
+    return messages[0], trace
+
+def test_repaired_by_filters_an_aggregate_question():
+    use_sheet_with_priya()
+    parsed = app.parse_query("most repeated issue for cnc machine repaired by priya")
+    assert parsed["intent"] == "most_repeated"
+    assert app.needs_sql_engine(parsed["intent"], parsed)
+
+    reply, trace = answer("most repeated issue for cnc machine repaired by priya")
+    assert trace.intent == "most_repeated"
+    assert reply.startswith("🔧 Most Repeated Issue(s) for cnc machine repaired by priya")
+    assert "Spindle Overheating" in reply and "**Occurrence Count:** 2" in reply
+
+def test_repaired_by_alone_lists_the_technicians_repairs():
+    use_sheet_with_priya()
+    reply, trace = answer("machines repaired by priya")
+    assert trace.intent == "technician_repairs"
+    assert reply.startswith("🔧 Machines repaired by priya")
+    assert reply.count("**Machine Name:**") == 3
@@ -0,0 +1,64 @@
+import os
+import datetime
+
+import app
+from test_sync import HEADER, make_worksheet
+
+def make_store():
+    values = make_worksheet(300).values
+    values[3][6] = "not a date"
+    values[5][8] = "n/a"
+    return app.RecordStore(app.records_from_values(HEADER, values))
+
+def test_published_snapshots_are_memory_mapped_and_match_the_original(monkeypatch, tmp_path):
+    store = make_store()
+    app.publish_snapshot(store, str(tmp_path), 1)
+    monkeypatch.setattr(app, "SHARED_SNAPSHOT_DIR", str(tmp_path))
+    monkeypatch.setattr(app, "record_store", None)
+    mapped = app.load_published_record_store()
+
+    assert isinstance(mapped.rows, app.MappedRows)
+    assert isinstance(mapped.production_loss, memoryview)
+    assert list(mapped.rows) == store.rows
+    assert mapped.rows[-1] == store.rows[-1]
+    assert list(mapped.production_loss) == list(store.production_loss)
+    start = datetime.date(2024, 3, 1).toordinal()
+    end = datetime.date(2024, 6, 30).toordinal()
+    for machine_id in store.by_id:
+        assert list(mapped.positions_by_id(machine_id)) == store.positions_by_id(machine_id)
+        assert mapped.latest_position(machine_id) == store.latest_position(machine_id)
+        assert mapped.timeline_positions(machine_id, start, end) == store.timeline_positions(machine_id, start, end)
+    assert mapped.view("by_id", "MM006").excluded_cells == 1
+    assert mapped.positions_by_id("MM999") == []
+
+def test_workers_load_snapshots_published_from_another_data_source(monkeypatch, tmp_path):
+    monkeypatch.setattr(app, "DATA_SOURCE", "sheet.csv")
+    app.publish_snapshot(make_store(), str(tmp_path), 1)
+    monkeypatch.setattr(app, "DATA_SOURCE", "gsheet")
+    monkeypatch.setattr(app, "SHARED_SNAPSHOT_DIR", str(tmp_path))
+    monkeypatch.setattr(app, "record_store", None)
+
+    assert len(app.load_published_record_store().rows) == 300
+    # A local snapshot is still only used for the sheet it was taken from
+    manifest = app.read_manifest(str(tmp_path))
+    assert app.load_snapshot(os.path.join(tmp_path, manifest["file"])) is None
+
+def test_a_copy_of_a_published_snapshot_takes_incremental_changes(tmp_path):
+    store = make_store()
+    app.publish_snapshot(store, str(tmp_path), 1)
+    manifest = app.read_manifest(str(tmp_path))
+    copy = app.load_snapshot(os.path.join(tmp_path, manifest["file"])).copy()
+
+    edited = dict(copy.rows[0], **{"Root Cause": "Loose belt"})
+    copy.replace_rows({0: edited})
+    copy.add_rows([dict(copy.rows[1], ID="MM041")])
+    assert copy.positions_by_id("MM041") == [300]
+    assert "Loose belt" in copy.view("by_id", "MM001").root_causes
+
+def test_only_the_newest_published_snapshots_are_kept(tmp_path):
+    store = make_store()
+    for version in range(1, app.SHARED_SNAPSHOTS_KEPT + 3):
+        app.publish_snapshot(store, str(tmp_path), version)
+    kept = sorted(name for name in os.listdir(tmp_path) if name.startswith("snapshot-"))
+    assert len(kept) == 2 * app.SHARED_SNAPSHOTS_KEPT
+    assert kept[0] == "snapshot-00000003.columns"
@@ -0,0 +1,80 @@
+import datetime
+
+import pytest
+
+import app
+from test_sync import HEADER, make_worksheet
+
+MACHINE_NAMES = ["CNC Machine", "Lathe Machine", "Milling Machine"]
+TECHNICIANS = ["Vikram", "Priya", "Anil", "Gopal"]
+ISSUES = ["Bearing Failure", "Spindle Overheating", "Chatter Marks", "Unexpected Shutdown", "Excessive Vibration"]
+
+def make_store():
+    values = make_worksheet(240).values
+    for number, row in enumerate(values):
+        row[1] = MACHINE_NAMES[int(row[0][2:]) % 3]
+        row[2] = ISSUES[number * 7 % 5]
+        row[5] = TECHNICIANS[number % 4]
+        row[7] = str(number % 5 + 1)
+        row[8] = f"{number % 9}%"
+    values[10][8] = "n/a"
+    return app.RecordStore(app.records_from_values(HEADER, values))
+
+def parsed(**filters):
+    return dict({"machine_id": None, "machine_name": None, "technician_name": None, "issue": None, "date_range": None}, **filters)
+
+@pytest.mark.parametrize("entity, index_name", [
+    ("machine_id", "by_id"),
+    ("machine_name", "by_machine_name"),
+    ("technician_name", "by_technician"),
+    ("issue", "by_issue"),
+])
+def test_single_filter_totals_and_issues_match_the_materialized_views(entity, index_name):
+    store = make_store()
+    engine = app.SQLEngine(store)
+    for key in getattr(store, index_name):
+        view = store.view(index_name, key)
+        repairs, production_loss, repair_time = engine.totals(parsed(**{entity: key}))
+        assert repairs == view.count
+        assert production_loss == pytest.approx(view.production_loss)
+        assert repair_time == pytest.approx(view.repair_time)
+        if view.issues is not None:
+            ranked = [(issue, issue_view.count) for issue, issue_view in view.top_issues()]
+            assert [(issue, count) for issue, count, _, _ in engine.issues(parsed(**{entity: key}))] == ranked
+
+    assert engine.totals(parsed()) == (240, pytest.approx(store.view().production_loss), pytest.approx(store.view().repair_time))
+
+def test_combined_filters_match_a_scan_of_the_rows():
+    store = make_store()
+    engine = app.SQLEngine(store)
+    start, end = datetime.date(2024, 3, 1).toordinal(), datetime.date(2024, 8, 31).toordinal()
+    filters = parsed(machine_name="lathe machine", technician_name="priya", date_range=(start, end, "from March to August 2024"))
+
+    positions = [
+        position for position, row in enumerate(store.rows)
+        if row["Machine Name"] == "Lathe Machine" and row["Technician Name"] == "Priya" and start <= store.repair_dates[position] <= end
+    ]
+    assert positions
+    assert engine.totals(filters) == (
+        len(positions),
+        pytest.approx(sum(store.production_loss[position] for position in positions)),
+        pytest.approx(sum(store.repair_time[position] for position in positions)),
+    )
+    assert sum(count for _, count, _, _ in engine.issues(filters)) == len(positions)
+    assert engine.distinct("machine_name", filters) == ["Lathe Machine"]
+
+@pytest.mark.parametrize("intent, filters, expected", [
+    ("production_loss", {"machine_name": "lathe machine"}, False),
+    ("production_loss", {"machine_name": "lathe machine", "issue": "chatter marks"}, True),
+    ("production_loss", {"machine_id": "MM001", "date_range": (1, 2, "")}, True),
+    ("count", {"machine_name": "lathe machine"}, False),
+    ("count", {"technician_name": "priya"}, True),
+    ("most_repeated", {"technician_name": "priya"}, False),
+    ("most_repeated", {"issue": "chatter marks"}, True),
+    ("root_cause", {"issue": "chatter marks"}, False),
+    ("root_cause", {"issue": "chatter marks", "machine_name": "lathe machine"}, True),
+    ("repair_history", {"machine_id": "MM001", "date_range": (1, 2, "")}, False),
+    ("technician_repairs", {"technician_name": "priya", "machine_name": "lathe machine"}, False),
+])
+def test_needs_sql_engine_only_for_filters_the_views_cannot_answer(intent, filters, expected):
+    assert app.needs_sql_engine(intent, parsed(**filters)) is expected
@@ -0,0 +1,74 @@
+import datetime
+
+import pytest
+
+import app
+
+HEADER = ["ID", "Machine Name", "Issue Description", "Root Cause", "Solution Applied", "Technician Name",
+          "Date of Repair", "Time Taken (in hours)", "Production Loss (%)", "Additional Notes"]
+
+def make_worksheet(rows):
+    values = [
+        [f"MM{number % 40 + 1:03d}", "CNC Machine", "Bearing Failure", "Wear", "Replaced part", "Vikram",
+         f"{number % 12 + 1}/1/2024", "2", "5%", ""]
+        for number in range(rows)
+    ]
+    return app.MemoryWorksheet(HEADER, values)
+
+def use_incremental_sheet(monkeypatch, worksheet):
+    monkeypatch.setattr(app, "SHEET_SYNC_MODE", "incremental")
+    app.set_data_source(worksheet)
+    app.request_full_sync()
+    return app.get_record_store()
+
+def test_manual_invalidation_picks_up_edits_to_old_rows(monkeypatch):
+    worksheet = make_worksheet(310)
+    store = use_incremental_sheet(monkeypatch, worksheet)
+    assert store.rows[0]["Root Cause"] == "Wear"
+
+    worksheet.values[0][3] = "Loose belt"
+    store = app.invalidate_machine_issues(blocking=True)
+
+    assert store.rows[0]["Root Cause"] == "Loose belt"
+    assert "Loose belt" in store.view("by_id", "MM001").root_causes
+
+def test_incremental_sync_converges_with_a_periodic_full_pass(monkeypatch):
+    monkeypatch.setattr(app, "SHEET_FULL_SYNC_EVERY", 3)
+    worksheet = make_worksheet(310)
+    use_incremental_sheet(monkeypatch, worksheet)
+    # The first sync of the process compared every row; the next ones only check the tail
+    app.refresh_record_store()
+
+    worksheet.values[0][8] = "50%"
+    seen = []
+    for _ in range(3):
+        seen.append(app.refresh_record_store().production_loss[0])
+    assert seen[0] == 5.0
+    assert seen[-1] == 50.0
+    assert app.record_store.view().production_loss == 5.0 * 309 + 50.0
+
+def test_xlsx_date_cells_are_read_as_sheet_dates(tmp_path):
+    openpyxl = pytest.importorskip("openpyxl")
+    workbook = openpyxl.Workbook()
+    workbook.active.append(HEADER)
+    for row in make_worksheet(3).values:
+        workbook.active.append(row[:6] + [datetime.datetime(2024, 3, int(row[0][2:]))] + row[7:])
+    path = tmp_path / "sheet.xlsx"
+    workbook.save(path)
+
+    app.set_data_source(app.LocalFileWorksheet(str(path)))
+    store = app.get_record_store()
+
+    assert store.rows[0]["Date of Repair"] == "3/1/2024"
+    assert store.invalid_cells == []
+    assert store.timeline_positions("MM002") == [1]
+
+def test_xlsx_date_cells_land_in_the_machine_timelines():
+    values = make_worksheet(3).values
+    for row in values:
+        row[6] = app.xlsx_cell(datetime.datetime(2024, 3, int(row[0][2:])))
+    store = app.RecordStore(app.records_from_values(HEADER, values))
+
+    assert [row["Date of Repair"] for row in store.rows] == ["3/1/2024", "3/2/2024", "3/3/2024"]
+    assert store.invalid_cells == []
+    assert store.timeline_positions("MM003") == [2]